@@ -1,42 +1,128 @@
-from pxr import Usd
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import time
+
+import numpy as np
+from pxr import Usd, Sdf, Vt, Gf
 from omniverse_utils import open_stage, start_omniverse, save_stage
-from pyproj import CRS, Transformer
+from georeferencing import ROADRUNNER, UTM33N, UTM_OFFSET, project
+
+# The roads are only offset horizontally, their heights are kept as is
+OFFSET = tuple(UTM_OFFSET[:2])
+
+def transform_points(points):
+    # Work in double precision, as UTM coordinates do not fit in floats
+    points = np.array(points, dtype=np.float64)
+
+    # Transform all points from RoadRunner to UTM33N at once, to Omniverse using offsets.
+    # The transformer is cached, so every process (including pool workers) only builds it once
+    new_x, new_z = project(points[:,0], points[:,1], ROADRUNNER, UTM33N)
+    points[:,0] = new_x - OFFSET[0]
+    points[:,1] = new_z - OFFSET[1]
+
+    return points.astype(np.float32)
+
+def hash_points(points):
+    # Hash of the vertex list, in the precision it is stored with in USD
+    return hashlib.sha1(np.ascontiguousarray(points, dtype=np.float32).tobytes()).hexdigest()
+
+def georeference_state(prim, points):
+    # "new" if the prim has no stamp or its points changed since (e.g. it was re-imported),
+    # "current" if it was transformed with the current settings, and "outdated" if it was
+    # transformed with other settings. Outdated points are not in RoadRunner coordinates anymore
+    stamp = prim.GetCustomDataByKey("georeference")
+    if not stamp or stamp.get("pointsHash") != hash_points(points):
+        return "new"
+
+    if stamp.get("sourceCrs") == ROADRUNNER and tuple(stamp.get("offset", ())) == OFFSET:
+        return "current"
+    return "outdated"
+
+def stamp_prim(prim, points):
+    # Record how the prim was transformed, so that re-runs can skip it
+    prim.SetCustomDataByKey("georeference", {
+        "sourceCrs": ROADRUNNER,
+        "offset": Gf.Vec2d(*OFFSET),
+        "pointsHash": hash_points(points)
+    })
+
+def transform_points_parallel(points_list, workers, chunk_size):
+    # Concatenate the points of all prims, and remember where each prim starts
+    counts = [len(points) for points in points_list]
+    offsets = np.cumsum(counts)[:-1]
+    points_all = np.concatenate(points_list) if points_list else np.empty((0, 3))
 
-def transform_meshes(stage):
-    # Create transformer to convert from RoadRunner to UTM33N coordinatess
-    proj_string = "+proj=tmerc +lat_0=63.41771242884644 +lon_0=10.40335350836009 +k=1 +x_0=0 +y_0=0 +datum=WGS84 +units=m +vunits=m +no_defs"
-    roadrunner = CRS.from_proj4(proj_string)
-    utm33n = CRS.from_epsg(32633)
-    transformer = Transformer.from_crs(roadrunner, utm33n)
+    # Split into evenly sized chunks, so small and large prims are balanced across workers
+    chunks = np.array_split(points_all, max(1, -(-len(points_all) // chunk_size)))
 
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        chunks_transformed = list(executor.map(transform_points, chunks))
+
+    # Split the result back into one array per prim
+    return np.split(np.concatenate(chunks_transformed), offsets)
+
+def transform_meshes(stage, bulk=True, workers=None, chunk_size=250000, force=False):
     # Get roads object (should already be imported to Omniverse)
     roads = stage.GetPrimAtPath("/RoadRunner_export")
 
-    # Loop through all road prims
-    for prim in Usd.PrimRange(roads):
-        # Only process meshes
-        if prim.GetTypeName() != "Mesh":
-            continue
-        
-        # Get vertex list
-        points = prim.GetAttribute("points").Get()
-
-        points_transformed = []
-        
-        # Transform points from RoadRunner to UTM33N, to Omniverse using offsets
-        for p in points:
-            x, z, y = p
-            new_x, new_z = transformer.transform(x, z)
-            new_x -= 270630.659
-            new_z -= 7040355.576
-            points_transformed.append((new_x, new_z, y))
-
-        # Overwrite vertices
-        prim.GetAttribute("points").Set(points_transformed)
+    # Only process meshes
+    meshes = [prim for prim in Usd.PrimRange(roads) if prim.GetTypeName() == "Mesh"]
+
+    time_start = time.perf_counter()
+
+    # Get vertex lists of all road prims
+    points_list = [np.asarray(prim.GetAttribute("points").Get()) for prim in meshes]
+
+    # Skip prims that have already been transformed and not changed since.
+    # Prims transformed with other settings are skipped too, as transforming them again
+    # would apply the transformation twice
+    if not force:
+        states = [georeference_state(prim, points) for prim, points in zip(meshes, points_list)]
+        outdated = states.count("outdated")
+        if outdated:
+            print(f"Skipping {outdated} meshes georeferenced with another CRS or offset! "
+                  "Re-import them, or use --force to transform them anyway")
+        todo = [i for i, state in enumerate(states) if state == "new"]
+        print(f"Skipping {states.count('current')} already georeferenced meshes")
+        meshes = [meshes[i] for i in todo]
+        points_list = [points_list[i] for i in todo]
 
+    point_count = sum(len(points) for points in points_list)
+
+    # Transform the vertex lists, either in a process pool or in this process.
+    # Only this process writes to the stage.
+    if workers:
+        points_transformed = transform_points_parallel(points_list, workers, chunk_size)
+    else:
+        points_transformed = [transform_points(points) for points in points_list]
+
+    if bulk:
+        # Overwrite vertices of all prims in one go, and save once
+        with Sdf.ChangeBlock():
+            for prim, points in zip(meshes, points_transformed):
+                prim.GetAttribute("points").Set(Vt.Vec3fArray.FromNumpy(points))
+                stamp_prim(prim, points)
         save_stage(stage)
+    else:
+        # Overwrite vertices and save for every prim, to follow progress live
+        for prim, points in zip(meshes, points_transformed):
+            prim.GetAttribute("points").Set(Vt.Vec3fArray.FromNumpy(points))
+            stamp_prim(prim, points)
+            save_stage(stage)
+
+    time_elapsed = time.perf_counter() - time_start
+    print(f"Transformed {point_count} points in {len(meshes)} meshes in {time_elapsed:.2f} s "
+          f"({point_count / max(time_elapsed, 1e-9):.0f} points/s)")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--live", action="store_true", help="Save the stage after every road prim")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes for reprojection")
+    parser.add_argument("--chunk-size", type=int, default=250000, help="Number of points per worker task")
+    parser.add_argument("--force", action="store_true", help="Transform all meshes, even already georeferenced ones")
+    args = parser.parse_args()
+
     start_omniverse(True)
     stage = open_stage("omniverse://gloshaugen.usd")
-    transform_meshes(stage)
+    transform_meshes(stage, bulk=not args.live, workers=args.workers, chunk_size=args.chunk_size, force=args.force)
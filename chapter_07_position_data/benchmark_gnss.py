@@ -0,0 +1,98 @@
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+from pxr import Usd, UsdGeom
+import rasterio
+from rasterio.transform import from_origin
+
+from connector_gnss import extract_gnss
+from georeferencing import UTM33N, UTM_OFFSET, WGS84, project
+from omniverse_utils import start_omniverse
+
+# Stages of a single update in extract_gnss, in order
+STAGES = ["parse", "project", "height", "offset", "quaternion", "write", "save"]
+
+def generate_raster(path, size=2000, resolution=10.0):
+    # Synthetic height map centered on the scene origin, with rolling hills
+    rows, cols = np.mgrid[0:size, 0:size]
+    data = (UTM_OFFSET[2] + 20 * np.sin(cols / 50) + 15 * np.cos(rows / 70)).astype(np.float32)
+
+    west = UTM_OFFSET[0] - size * resolution / 2
+    north = UTM_OFFSET[1] + size * resolution / 2
+    with rasterio.open(path, "w", driver="GTiff", height=size, width=size, count=1, dtype="float32",
+                       crs=UTM33N, transform=from_origin(west, north, resolution, resolution)) as raster:
+        raster.write(data, 1)
+
+def generate_track(path, rows=2000, speed=10.0, interval=0.1):
+    # Synthetic drive: a random walk with smoothly varying heading around the scene origin
+    rng = np.random.default_rng(0)
+    heading = np.cumsum(rng.normal(0, 0.05, rows))
+    easting = UTM_OFFSET[0] + np.cumsum(np.cos(heading)) * speed * interval
+    northing = UTM_OFFSET[1] + np.cumsum(np.sin(heading)) * speed * interval
+
+    lat, lon = project(easting, northing, UTM33N, WGS84)
+    alt = np.full(rows, UTM_OFFSET[2])
+    np.savetxt(path, np.column_stack((lat, lon, alt)), delimiter=",", fmt="%.9f")
+
+def create_car(path_stage):
+    # Local stage with a car that has the same xform ops as in the scene
+    stage = Usd.Stage.CreateNew(path_stage)
+    car = UsdGeom.Xform.Define(stage, "/Root/car")
+    car.AddTranslateOp()
+    car.AddRotateXYZOp()
+    car.AddScaleOp()
+    car.AddOrientOp()
+    stage.GetRootLayer().Save()
+
+    return stage, car
+
+def run_connector(stage, path_track, path_raster, height_cache):
+    # Run extract_gnss without waiting between updates, timing every stage of every update
+    timings = {name: [] for name in ["open", *STAGES]}
+
+    def on_stage(name, seconds):
+        timings[name].append(seconds)
+
+    time_total = time.perf_counter()
+    extract_gnss(stage, path_track, "car", path_raster, height_cache, delay=0, on_stage=on_stage)
+    time_total = time.perf_counter() - time_total - timings["open"][0]
+    print(f"Height map opened in {timings['open'][0] * 1000:.1f} ms")
+
+    return timings, time_total
+
+def report(timings, time_total):
+    updates = len(timings["save"])
+    totals = np.sum([timings[name] for name in STAGES], axis=0)
+
+    print(f"{'stage':<12}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, values in [*[(name, timings[name]) for name in STAGES], ("total", totals)]:
+        p50, p95, p99 = np.percentile(values, [50, 95, 99]) * 1000
+        print(f"{name:<12}{p50:>10.3f}{p95:>10.3f}{p99:>10.3f}")
+    print(f"{updates} updates in {time_total:.2f} s ({updates / time_total:.0f} updates/s)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=2000, help="Number of GNSS readings")
+    parser.add_argument("--raster-size", type=int, default=2000, help="Width and height of the height map in pixels")
+    parser.add_argument("--height-cache", action="store_true", help="Use the precomputed height field")
+    args = parser.parse_args()
+
+    start_omniverse(False)
+
+    with tempfile.TemporaryDirectory() as path_tmp:
+        path_raster = os.path.join(path_tmp, "heights.tif")
+        path_track = os.path.join(path_tmp, "track.csv")
+        path_stage = os.path.join(path_tmp, "benchmark.usda")
+
+        print("Generating synthetic height map and track...")
+        generate_raster(path_raster, args.raster_size)
+        generate_track(path_track, args.rows)
+
+        # extract_gnss closes the raster or the memory mapped height field when done,
+        # so the temporary directory can be removed afterwards (also on Windows)
+        stage, _ = create_car(path_stage)
+        height_cache = os.path.join(path_tmp, "height_cache") if args.height_cache else None
+        report(*run_connector(stage, path_track, path_raster, height_cache))
@@ -0,0 +1,92 @@
+import argparse
+import time
+
+import numpy as np
+from pxr import Gf, UsdGeom, Sdf
+
+from connector_gnss import load_track, compute_timestamps, compute_positions, compute_orientations, get_xform_op
+from height_map import open_height_map
+from omniverse_utils import start_omniverse, open_stage, save_stage
+
+def load_fleet(stage, tracks, rasterpath, height_cache=None, timestamp_column=None, timestamp_scale=1.0):
+    # All vehicles share the same height map
+    fleet = []
+    with open_height_map(rasterpath, height_cache) as height_map:
+        for filename, primname in tracks:
+            # Obtains a variable reference to an already existing car object, and looks up
+            # its ops once, instead of on every tick
+            car = UsdGeom.Xform.Define(stage, f"/Root/{primname}")
+            ops = (get_xform_op(car, UsdGeom.XformOp.TypeTranslate), get_xform_op(car, UsdGeom.XformOp.TypeOrient))
+
+            # Compute the vehicle's entire trajectory in bulk
+            coords = load_track(filename)
+            timestamps = compute_timestamps(coords, timestamp_column, timestamp_scale)
+            positions = compute_positions(coords, height_map)
+            orientations = compute_orientations(positions)
+
+            fleet.append((ops, timestamps, positions, orientations))
+
+    return fleet
+
+def play_fleet(stage, fleet, tick=0.01):
+    # Step all vehicles on a shared clock
+    duration = max(timestamps[-1] for _, timestamps, _, _ in fleet)
+    ticks = np.arange(0, duration + tick, tick)
+
+    # The readings of all vehicles in time order, and how many of them are due at every tick
+    times = np.concatenate([timestamps for _, timestamps, _, _ in fleet])
+    vehicles = np.concatenate([np.full(len(timestamps), v) for v, (_, timestamps, _, _) in enumerate(fleet)])
+    readings = np.concatenate([np.arange(len(timestamps)) for _, timestamps, _, _ in fleet])
+    order = np.argsort(times, kind="stable")
+    vehicles, readings = vehicles[order], readings[order]
+    ends = np.searchsorted(times[order], ticks, side="right")
+
+    updates = 0
+    cursor = 0
+    time_start = time.perf_counter()
+
+    for tick_time, end in zip(ticks, ends):
+        # The latest new reading of every vehicle that has one
+        changed = dict(zip(vehicles[cursor:end].tolist(), readings[cursor:end].tolist()))
+        cursor = end
+
+        # Write the transforms of all vehicles that have a new reading in one go, and save
+        # once per tick. The save is skipped when no vehicle has a new reading
+        if changed:
+            with Sdf.ChangeBlock():
+                for v, reading in changed.items():
+                    (translate_op, orient_op), _, positions, orientations = fleet[v]
+                    translate_op.Set(Gf.Vec3d(*positions[reading]))
+                    orient_op.Set(Gf.Quatf(*orientations[reading]))
+            save_stage(stage)
+            updates += len(changed)
+
+        # Wait for the next tick
+        delay = time_start + tick_time + tick - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+
+    time_elapsed = time.perf_counter() - time_start
+    print(f"Played {len(fleet)} vehicles: {len(ticks)} ticks, {updates} vehicle updates in {time_elapsed:.2f} s "
+          f"({updates / max(time_elapsed, 1e-9):.0f} updates/s)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("tracks", nargs="+", help="Pairs of GNSS CSV file and prim name")
+    parser.add_argument("--tick", type=float, default=0.01, help="Seconds between updates")
+    parser.add_argument("--height-cache", default="height_cache")
+    parser.add_argument("--timestamp-column", type=int, default=None, help="CSV column holding the recorded timestamps")
+    parser.add_argument("--timestamp-scale", type=float, default=1.0, help="Seconds per timestamp unit")
+
+    path_rasterpath = "7002_2_10m_z33.tif"
+
+    args = parser.parse_args()
+    if len(args.tracks) % 2 != 0:
+        parser.error("tracks must be given as pairs of CSV file and prim name")
+    tracks = list(zip(args.tracks[::2], args.tracks[1::2]))
+
+    start_omniverse(True)
+    stage = open_stage("omniverse://gloshaugen.usd")
+
+    fleet = load_fleet(stage, tracks, path_rasterpath, args.height_cache, args.timestamp_column, args.timestamp_scale)
+    play_fleet(stage, fleet, args.tick)
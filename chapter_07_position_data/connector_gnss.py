@@ -2,30 +2,23 @@ import argparse
 import csv
 import time
 
-from pxr import UsdGeom, Gf
-from pyproj import CRS, Transformer
+from pxr import Usd, UsdGeom, Gf, Sdf
 import numpy as np
-import rasterio
-from scipy.interpolate import interp2d
+from numpy.lib.stride_tricks import sliding_window_view
 
+from georeferencing import wgs84_to_utm, to_scene
+from height_map import open_height_map
 from omniverse_utils import start_omniverse, open_stage, save_stage
 
 def project_to_utm(x, y, z):
     # Project from WGS84 (latlon) to UTM33N
-    wgs84 = CRS.from_epsg(4326)
-    utm33n = CRS.from_epsg(32633)
-    transformer = Transformer.from_crs(wgs84, utm33n)
-    new_x, new_z = transformer.transform(z, x)
+    new_x, new_z = wgs84_to_utm(z, x)
 
     return (new_x, y, new_z)
 
 def utm_offset(x, y, z):
     # Apply UTM offset
-    new_x = x - 270630.659
-    new_z = -(z - 7040355.576)
-    new_y = y - 46.670
-
-    return (new_x, new_y, new_z)
+    return tuple(to_scene((x, z, y)))
 
 def translate(mesh, x, y, z):
     # Set new position of mesh
@@ -35,56 +28,59 @@ def rotate(mesh, w, x, y, z):
     # Rotate mesh
     mesh.GetOrderedXformOps()[3].Set(Gf.Quatf(w, x, y, z))
 
-def interpolate_raster(path_raster):
-    # Read raster map
-    raster = rasterio.open(path_raster)
-    data = raster.read(1)
-
-    # Generate an integer range for every pixel in the raster map
-    x = np.arange(0, raster.width, 1.0)
-    y = np.arange(0, raster.height, 1.0)
-    
-    # Interpolate values inbetween values in the integer ranges
-    data_interpolated = interp2d(x, y, data, kind="cubic")
-
-    # Transformation matrix to transform from UTM to pixel coords
-    transform_inverse = np.linalg.inv(np.resize(raster.transform, (3, 3)))
+def compute_rotation(coords_prev, coords_current):
+    # Compute the rotation quaternion between two coordinate readings
+    v1 = [0, 0, 1]
+    v2 = coords_current - coords_prev
+    xyz = np.cross(v1, v2)
+    w = np.sqrt(np.linalg.norm(v1) ** 2 * np.linalg.norm(v2) ** 2) + np.dot(v1, v2)
+    q = np.asarray([w, *xyz])
+    q[1] = 0
 
-    return transform_inverse, data_interpolated
+    q /= np.linalg.norm(q)
 
-def sample_raster(transform, data_interpolated, utm_x, utm_y):
-    # Sample values from georeferenced raster based on pixel coords
-    pixel_x, pixel_y = (transform @ (utm_x, utm_y, 1.0))[:-1]
-    return data_interpolated(pixel_x, pixel_y)[0]
+    return q
 
-def extract_gnss(stage, filename, primname, rasterpath):
+def extract_gnss(stage, filename, primname, rasterpath, height_cache=None, delay=0.01, on_stage=None):
     # Obtains a variable reference to an already existing car object
     car = UsdGeom.Xform.Define(stage, f"/Root/{primname}")
     
     # Converts a list of strings to a list of floats
     def coords_to_float(row):
         return list(map(lambda c: float(c), row))
+
+    # Reports the duration of every stage of an update to on_stage (see benchmark_gnss)
+    stage_start = [time.perf_counter()]
+    def finish_stage(name):
+        time_now = time.perf_counter()
+        if on_stage:
+            on_stage(name, time_now - stage_start[0])
+        stage_start[0] = time_now
     
     # Store previous coordinates and quaternions
     coords_prev = []
     q_prev = []
 
-    # Interpolated height map
-    height_transform, height_interpolated = interpolate_raster(rasterpath)
+    # Interpolated height map, either precomputed or read tile by tile as the car moves
+    height_map = open_height_map(rasterpath, height_cache)
+    finish_stage("open")
 
-    # Read CSV file with WGS84 coordinates
-    with open(filename) as csvfile:
+    # Read CSV file with WGS84 coordinates. The height map is closed when done
+    with height_map, open(filename) as csvfile:
         reader = csv.reader(csvfile, delimiter=",")
 
         for row in reader:
             # Cast coordinates from string to float
             coords = coords_to_float(row)
+            finish_stage("parse")
 
             # Project to UTM33N
             x, _, z = project_to_utm(coords[1], coords[2], coords[0])
+            finish_stage("project")
 
             # Get height from interpolated height map
-            y = sample_raster(height_transform, height_interpolated, x, z)
+            y = height_map.sample(x, z)
+            finish_stage("height")
 
             # Apply UTM offset
             x, y, z = utm_offset(x, y, z)
@@ -94,41 +90,188 @@ def extract_gnss(stage, filename, primname, rasterpath):
             y += 1.5
 
             coords_current = np.asarray([x, y, z])
+            finish_stage("offset")
 
             # Only process rotation if the previous coordinate is different than the current,
             # and only if the current reading is not the first 
+            orientation = None
             if not np.array_equal(coords_current, coords_prev) and len(coords_prev) > 0:
                 # Compute the rotation quaternion between the coordinate readings
-                v1 = [0, 0, 1]
-                v2 = coords_current - coords_prev
-                xyz = np.cross(v1, v2)
-                w = np.sqrt(np.linalg.norm(v1) ** 2 * np.linalg.norm(v2) ** 2) + np.dot(v1, v2)
-                q = np.asarray([w, *xyz])
-                q[1] = 0
-                
-                q /= np.linalg.norm(q)
-
-                q_prev.append(q)
+                q_prev.append(compute_rotation(coords_prev, coords_current))
 
                 # Perform smoothing by computing the average of the last 10 quaternions
                 if len(q_prev) >= 10:
-                    rotate(car, *np.average(np.asarray(q_prev), axis=0))
+                    orientation = np.average(np.asarray(q_prev), axis=0)
                     q_prev.pop(0)
 
             # Update variable for previous coordinate
             coords_prev = coords_current
+            finish_stage("quaternion")
 
-            # Set position of mesh
+            # Set rotation and position of mesh
+            if orientation is not None:
+                rotate(car, *orientation)
             translate(car, x, y, z)
+            finish_stage("write")
 
             # Save and wait
             save_stage(stage)
-            time.sleep(0.01)
+            finish_stage("save")
+            time.sleep(delay)
+            stage_start[0] = time.perf_counter()
+
+def load_track(filename):
+    # Read the entire CSV file with WGS84 coordinates (lat, lon, alt) at once
+    return np.loadtxt(filename, delimiter=",", ndmin=2)
+
+def compute_timestamps(coords, timestamp_column=None, timestamp_scale=1.0, interval=0.01):
+    # Seconds since the first reading. Tracks without a timestamp column
+    # are assumed to be recorded at a fixed interval
+    if timestamp_column is None:
+        return np.arange(len(coords)) * interval
+
+    timestamps = coords[:,timestamp_column] * timestamp_scale
+    return timestamps - timestamps[0]
+
+def compute_positions(coords, height_map):
+    # Project all coordinates to UTM33N, and get their heights from the height map
+    easting, northing = wgs84_to_utm(coords[:,0], coords[:,1])
+    heights = height_map.sample(easting, northing)
+
+    # Apply UTM offset
+    positions = to_scene(np.column_stack((easting, northing, heights)))
+
+    # Account for the fact that the GNSS sender, i.e. the center of
+    # the car objects, is located on top of the car
+    positions[:,1] += 1.5
+
+    return positions
+
+def compute_headings(positions):
+    # Compute the rotation quaternions between all consecutive readings.
+    # Only readings that differ from the previous one get a quaternion.
+    v2 = np.diff(positions, axis=0)
+    moved = np.any(v2 != 0, axis=1)
+    v2 = v2[moved]
+
+    # With v1 = [0, 0, 1], the cross product is [-v2y, v2x, 0], and the
+    # quaternion's X component is discarded
+    q = np.zeros((len(v2), 4))
+    q[:,0] = np.linalg.norm(v2, axis=1) + v2[:,2]
+    q[:,2] = v2[:,0]
+
+    # Moving straight backwards gives a zero quaternion. Turn around instead
+    norm = np.linalg.norm(q, axis=1)
+    q[norm == 0] = [0, 0, 1, 0]
+    norm[norm == 0] = 1
+
+    q /= norm[:,np.newaxis]
+
+    return q, moved
+
+def compute_orientations(positions, window=10):
+    q, moved = compute_headings(positions)
+
+    # Perform smoothing by computing the average of the last quaternions
+    if len(q) < window:
+        return np.tile([1.0, 0.0, 0.0, 0.0], (len(positions), 1))
+    q_smoothed = sliding_window_view(q, window, axis=0).mean(axis=-1)
+
+    # Number of quaternions computed up to and including each reading.
+    # Readings where the car did not move keep the previous orientation,
+    # and readings before the first full window get the first smoothed one
+    counts = np.concatenate(([0], np.cumsum(moved)))
+    indices = np.maximum(counts - window, 0)
+
+    return q_smoothed[indices]
+
+def compute_trajectory(filename, rasterpath, height_cache=None, window=10, timestamp_column=None, timestamp_scale=1.0):
+    # Compute timestamps, positions and orientations for the entire GNSS track in bulk
+    coords = load_track(filename)
+    timestamps = compute_timestamps(coords, timestamp_column, timestamp_scale)
+    with open_height_map(rasterpath, height_cache) as height_map:
+        positions = compute_positions(coords, height_map)
+    orientations = compute_orientations(positions, window)
+
+    return timestamps, positions, orientations
+
+def replay_trajectory(stage, primname, positions, orientations):
+    # Replay precomputed positions and orientations on a car object
+    car = UsdGeom.Xform.Define(stage, f"/Root/{primname}")
+
+    for position, orientation in zip(positions, orientations):
+        translate(car, *position)
+        rotate(car, *orientation)
+
+        # Save and wait
+        save_stage(stage)
+        time.sleep(0.01)
+
+def get_xform_op(xform, op_type):
+    # The car's op of the given type (e.g. translate or orient), wherever it is in the op order
+    for op in xform.GetOrderedXformOps():
+        if op.GetOpType() == op_type:
+            return op
+    raise ValueError(f"{xform.GetPath()} has no {op_type} op")
+
+def export_trajectory(stage, primname, timestamps, positions, orientations, path_sublayer=None):
+    # Author the entire trajectory as time samples on the car's translate and
+    # orient ops, instead of saving the stage for every reading
+    if not len(timestamps):
+        print("The track has no readings, nothing to export")
+        return
+
+    root_layer = stage.GetRootLayer()
+    layer = root_layer
+
+    if path_sublayer:
+        # Write the trajectory to a separate sublayer of the stage
+        layer = Sdf.Layer.FindOrOpen(path_sublayer) or Sdf.Layer.CreateNew(path_sublayer)
+        if path_sublayer not in root_layer.subLayerPaths:
+            root_layer.subLayerPaths.insert(0, path_sublayer)
+
+    car = UsdGeom.Xform.Define(stage, f"/Root/{primname}")
+    translate_op = get_xform_op(car, UsdGeom.XformOp.TypeTranslate)
+    orient_op = get_xform_op(car, UsdGeom.XformOp.TypeOrient)
+
+    if path_sublayer:
+        # Default values in the (stronger) root layer would hide the sublayer's
+        # time samples. Remove them before switching to the sublayer
+        for op in (translate_op, orient_op):
+            spec = root_layer.GetAttributeAtPath(op.GetAttr().GetPath())
+            if spec:
+                spec.ClearDefaultValue()
+        stage.SetEditTarget(Usd.EditTarget(layer))
+
+    # Convert timestamps to stage time codes
+    time_codes = timestamps * stage.GetTimeCodesPerSecond()
+
+    print(f"Writing {len(time_codes)} time samples...")
+    with Sdf.ChangeBlock():
+        for time_code, position, orientation in zip(time_codes, positions, orientations):
+            translate_op.Set(Gf.Vec3d(*position), time_code)
+            orient_op.Set(Gf.Quatf(*orientation), time_code)
+
+    # Let the stage play back the entire trajectory
+    stage.SetEditTarget(Usd.EditTarget(root_layer))
+    stage.SetStartTimeCode(time_codes[0])
+    stage.SetEndTimeCode(time_codes[-1])
+
+    if path_sublayer:
+        layer.Save()
+    save_stage(stage)
+    print("Trajectory exported!")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("path")
     parser.add_argument("primname")
+    parser.add_argument("--height-cache", default="height_cache")
+    parser.add_argument("--offline", action="store_true", help="Compute the entire trajectory before replaying it")
+    parser.add_argument("--export", action="store_true", help="Write the entire trajectory as time samples")
+    parser.add_argument("--sublayer", default=None, help="Sublayer to write the time samples to, as an absolute path or URL")
+    parser.add_argument("--timestamp-column", type=int, default=None, help="CSV column holding the recorded timestamps")
+    parser.add_argument("--timestamp-scale", type=float, default=1.0, help="Seconds per timestamp unit")
 
     path_rasterpath = "7002_2_10m_z33.tif"
 
@@ -136,4 +279,13 @@ if __name__ == "__main__":
     stage = open_stage("omniverse://gloshaugen.usd")
 
     args = parser.parse_args()
-    extract_gnss(stage, args.path, args.primname)
\ No newline at end of file
+    if args.offline or args.export:
+        timestamps, positions, orientations = compute_trajectory(args.path, path_rasterpath, args.height_cache,
+                                                                 timestamp_column=args.timestamp_column,
+                                                                 timestamp_scale=args.timestamp_scale)
+        if args.export:
+            export_trajectory(stage, args.primname, timestamps, positions, orientations, args.sublayer)
+        else:
+            replay_trajectory(stage, args.primname, positions, orientations)
+    else:
+        extract_gnss(stage, args.path, args.primname, path_rasterpath, args.height_cache)
\ No newline at end of file
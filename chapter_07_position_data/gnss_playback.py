@@ -0,0 +1,118 @@
+import argparse
+import asyncio
+import time
+
+import numpy as np
+from pxr import UsdGeom
+
+from connector_gnss import compute_trajectory, translate, rotate
+from omniverse_utils import start_omniverse, open_stage, save_stage
+from tile_index import TileIndex
+
+# Marks the end of the trajectory in the pose queue
+END = None
+
+async def produce_poses(queue, filename, rasterpath, height_cache, timestamp_column, timestamp_scale):
+    # Precompute all poses in a worker thread, so the event loop stays responsive.
+    # The end is always marked, so the consumer stops even if this fails
+    try:
+        loop = asyncio.get_running_loop()
+        timestamps, positions, orientations = await loop.run_in_executor(
+            None, lambda: compute_trajectory(filename, rasterpath, height_cache,
+                                             timestamp_column=timestamp_column, timestamp_scale=timestamp_scale))
+
+        for pose in zip(timestamps, positions, orientations):
+            await queue.put(pose)
+    finally:
+        await queue.put(END)
+
+async def publish_poses(queue, stage, car, speed, tile_index=None, radius=500):
+    latencies = []
+    drifts = []
+    dropped = 0
+
+    pending = await queue.get()
+
+    # Recorded timestamps are relative to the first reading
+    time_start = time.perf_counter()
+    def scheduled(pose):
+        return time_start + pose[0] / speed
+
+    while pending is not END:
+        pose = pending
+        pending = await queue.get()
+
+        # If publishing has fallen behind, skip ahead to the latest pose that is already due
+        while pending is not END and scheduled(pending) <= time.perf_counter():
+            pose = pending
+            pending = await queue.get()
+            dropped += 1
+
+        # Wait until the pose's recorded timestamp
+        delay = scheduled(pose) - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        # Publish pose
+        time_publish = time.perf_counter()
+        translate(car, *pose[1])
+        rotate(car, *pose[2])
+        save_stage(stage)
+
+        # Only keep the buildings around the car loaded
+        if tile_index is not None:
+            tile_index.update(pose[1], radius)
+
+        latencies.append(time.perf_counter() - time_publish)
+        drifts.append(time_publish - scheduled(pose))
+
+    return np.asarray(latencies), np.asarray(drifts), dropped
+
+def report(latencies, drifts, dropped):
+    print(f"Published {len(latencies)} poses, dropped {dropped}")
+    if len(latencies) == 0:
+        return
+
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+    print(f"Publish latency: p50 {p50:.1f} ms, p95 {p95:.1f} ms, p99 {p99:.1f} ms")
+    print(f"Drift: mean {np.mean(drifts) * 1000:.1f} ms, max {np.max(drifts) * 1000:.1f} ms, "
+          f"final {drifts[-1] * 1000:.1f} ms")
+
+async def play(stage, filename, primname, rasterpath, height_cache=None, speed=1.0,
+               timestamp_column=None, timestamp_scale=1.0, queue_size=256, buildings_radius=None):
+    # Obtains a variable reference to an already existing car object
+    car = UsdGeom.Xform.Define(stage, f"/Root/{primname}")
+
+    # Bounded queue between the producer and the publishing consumer
+    queue = asyncio.Queue(maxsize=queue_size)
+
+    producer = asyncio.create_task(produce_poses(queue, filename, rasterpath, height_cache,
+                                                 timestamp_column, timestamp_scale))
+    tile_index = TileIndex(stage) if buildings_radius else None
+    latencies, drifts, dropped = await publish_poses(queue, stage, car, speed, tile_index, buildings_radius)
+
+    # Raises the producer's error, e.g. for a missing file
+    await producer
+
+    report(latencies, drifts, dropped)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("path")
+    parser.add_argument("primname")
+    parser.add_argument("--speed", type=float, default=1.0, help="Playback speed multiplier")
+    parser.add_argument("--height-cache", default="height_cache")
+    parser.add_argument("--timestamp-column", type=int, default=None, help="CSV column holding the recorded timestamps")
+    parser.add_argument("--timestamp-scale", type=float, default=1.0, help="Seconds per timestamp unit")
+    parser.add_argument("--buildings-radius", type=float, default=None, help="Only load buildings within this distance (meters) of the car")
+
+    path_rasterpath = "7002_2_10m_z33.tif"
+
+    args = parser.parse_args()
+
+    # With a radius, buildings are loaded as the car approaches them
+    start_omniverse(True)
+    stage = open_stage("omniverse://gloshaugen.usd", load_payloads=args.buildings_radius is None)
+
+    asyncio.run(play(stage, args.path, args.primname, path_rasterpath, args.height_cache, args.speed,
+                     args.timestamp_column, args.timestamp_scale, buildings_radius=args.buildings_radius))
@@ -0,0 +1,173 @@
+import argparse
+from collections import deque
+from functools import reduce
+import socket
+import sys
+import time
+
+import numpy as np
+from pxr import UsdGeom
+
+from connector_gnss import compute_headings, translate, rotate
+from georeferencing import wgs84_to_utm, to_scene
+from height_map import open_height_map
+from omniverse_utils import start_omniverse, open_stage, save_stage
+
+def read_lines(source):
+    # Read lines from a TCP socket (tcp://host:port), stdin (-) or a file/named pipe
+    if source == "-":
+        yield from sys.stdin
+    elif source.startswith("tcp://"):
+        host, port = source[len("tcp://"):].rsplit(":", 1)
+        with socket.create_connection((host, int(port))) as connection:
+            yield from connection.makefile("r")
+    else:
+        with open(source) as file_source:
+            yield from file_source
+
+def nmea_checksum_valid(sentence):
+    # Sentences without a checksum are accepted as is
+    if "*" not in sentence:
+        return True
+    data, checksum = sentence[1:].split("*", 1)
+    return reduce(lambda a, c: a ^ ord(c), data, 0) == int(checksum[:2], 16)
+
+def nmea_to_degrees(value, hemisphere):
+    # Convert (d)ddmm.mmmm to decimal degrees
+    degrees = int(float(value) / 100)
+    degrees += (float(value) - degrees * 100) / 60
+    return -degrees if hemisphere in ("S", "W") else degrees
+
+def parse_fixes(lines):
+    # Parse NMEA GGA sentences or CSV rows (lat, lon, alt) into (lat, lon, alt) fixes
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+
+        if line.startswith("$"):
+            # Malformed sentences (e.g. a bad checksum field or empty coordinates) are skipped
+            try:
+                if not nmea_checksum_valid(line):
+                    continue
+                fields = line.split("*")[0].split(",")
+
+                # Only GGA sentences with a valid fix carry both position and altitude
+                if not fields[0].endswith("GGA") or len(fields) < 10 or fields[6] in ("", "0"):
+                    continue
+                lat = nmea_to_degrees(fields[2], fields[3])
+                lon = nmea_to_degrees(fields[4], fields[5])
+                alt = float(fields[9]) if fields[9] else 0.0
+            except ValueError:
+                continue
+            yield lat, lon, alt
+        else:
+            try:
+                lat, lon, alt = map(float, line.split(",")[:3])
+            except ValueError:
+                continue
+            yield lat, lon, alt
+
+def project_fixes(fixes, height_map):
+    # Project to UTM33N, get height from the height map, and apply UTM offset
+    for lat, lon, _ in fixes:
+        easting, northing = wgs84_to_utm(lat, lon)
+        height = height_map.sample(easting, northing)
+        position = to_scene((easting, northing, height))
+
+        # Account for the fact that the GNSS sender, i.e. the center of
+        # the car objects, is located on top of the car
+        position[1] += 1.5
+
+        yield position
+
+def smooth_orientations(positions, window=10):
+    # Compute the rotation quaternion between consecutive readings, and smooth it
+    # over the last quaternions. Only the last window of quaternions is kept.
+    q_prev = deque(maxlen=window)
+    orientation = None
+    position_prev = None
+
+    for position in positions:
+        if position_prev is not None:
+            q, _ = compute_headings(np.asarray([position_prev, position]))
+            q_prev.extend(q)
+
+            if len(q) and len(q_prev) == window:
+                orientation = np.average(np.asarray(q_prev), axis=0)
+
+        position_prev = position
+        yield position, orientation
+
+def publish(stage, car, poses):
+    latencies = []
+
+    for position, orientation in poses:
+        time_publish = time.perf_counter()
+
+        # Set position and rotation of mesh
+        translate(car, *position)
+        if orientation is not None:
+            rotate(car, *orientation)
+        save_stage(stage)
+
+        # Report publish latency regularly
+        latencies.append(time.perf_counter() - time_publish)
+        if len(latencies) == 100:
+            print(f"Publish latency: mean {np.mean(latencies) * 1000:.1f} ms, max {np.max(latencies) * 1000:.1f} ms")
+            latencies.clear()
+
+def follow(stage, source, primname, rasterpath, height_cache=None):
+    # Obtains a variable reference to an already existing car object
+    car = UsdGeom.Xform.Define(stage, f"/Root/{primname}")
+
+    # Generator pipeline: every fix flows through all stages before the next is read
+    with open_height_map(rasterpath, height_cache) as height_map:
+        lines = read_lines(source)
+        fixes = parse_fixes(lines)
+        positions = project_fixes(fixes, height_map)
+        poses = smooth_orientations(positions)
+        publish(stage, car, poses)
+
+def serve_replay(filename, port, interval=0.1):
+    # Stand-in for a GNSS receiver: send the lines of a recorded file to
+    # every client that connects, one line per interval
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as server:
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server.bind(("localhost", port))
+        server.listen()
+        print(f"Replaying {filename} on tcp://localhost:{port}")
+        while True:
+            connection, _ = server.accept()
+            with connection, open(filename) as file_track:
+                try:
+                    for line in file_track:
+                        connection.sendall(line.encode())
+                        time.sleep(interval)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    parser_follow = subparsers.add_parser("follow", help="Follow a live stream of GNSS fixes")
+    parser_follow.add_argument("source", help="tcp://host:port, a file or named pipe, or - for stdin")
+    parser_follow.add_argument("primname")
+    parser_follow.add_argument("--height-cache", default="height_cache")
+
+    parser_serve = subparsers.add_parser("serve", help="Replay a recorded file over TCP")
+    parser_serve.add_argument("path")
+    parser_serve.add_argument("--port", type=int, default=5000)
+    parser_serve.add_argument("--interval", type=float, default=0.1, help="Seconds between lines")
+
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        serve_replay(args.path, args.port, args.interval)
+    else:
+        path_rasterpath = "7002_2_10m_z33.tif"
+
+        start_omniverse(True)
+        stage = open_stage("omniverse://gloshaugen.usd")
+        follow(stage, args.source, args.primname, path_rasterpath, args.height_cache)
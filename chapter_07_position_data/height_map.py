@@ -0,0 +1,193 @@
+import argparse
+from collections import OrderedDict
+import hashlib
+import os
+
+import numpy as np
+import rasterio
+from rasterio.windows import Window
+from scipy.interpolate import RectBivariateSpline
+from scipy.ndimage import map_coordinates, spline_filter
+
+from file_utils import atomic_path
+
+def utm_to_pixel(transform_inverse, width, height, utm_x, utm_y):
+    # Convert UTM coordinates to (fractional) pixel coordinates, clamped to the raster
+    pixel_x, pixel_y = transform_inverse * (utm_x, utm_y)
+
+    pixel_x = np.clip(pixel_x, 0, width - 1)
+    pixel_y = np.clip(pixel_y, 0, height - 1)
+
+    return pixel_x, pixel_y
+
+class HeightSampler:
+    # Samples heights from a georeferenced raster map (e.g. a DEM), reading and
+    # interpolating only the tiles around the queried points. Recently used
+    # tiles are kept in an LRU cache.
+
+    def __init__(self, path_raster, tile_size=256, max_tiles=16, halo=8):
+        self.raster = rasterio.open(path_raster)
+        self.tile_size = tile_size
+        self.max_tiles = max_tiles
+
+        # Extra pixels read around each tile, so that the splines of neighbouring
+        # tiles agree along the tile borders
+        self.halo = halo
+
+        self.tiles = OrderedDict()
+        self.tile_cols = -(-self.raster.width // tile_size)
+
+        # Affine transformation to transform from UTM to pixel coords
+        self.transform_inverse = ~self.raster.transform
+
+    def read_tile(self, tile_row, tile_col):
+        # Pixel range of the tile, including the halo
+        row_start = max(tile_row * self.tile_size - self.halo, 0)
+        row_stop = min((tile_row + 1) * self.tile_size + self.halo, self.raster.height)
+        col_start = max(tile_col * self.tile_size - self.halo, 0)
+        col_stop = min((tile_col + 1) * self.tile_size + self.halo, self.raster.width)
+
+        # Only read the window of the raster covered by the tile
+        window = Window(col_start, row_start, col_stop - col_start, row_stop - row_start)
+        data = self.raster.read(1, window=window)
+
+        # Fit a bicubic spline to the tile
+        rows = np.arange(row_start, row_stop, dtype=np.float64)
+        cols = np.arange(col_start, col_stop, dtype=np.float64)
+        return RectBivariateSpline(rows, cols, data, kx=3, ky=3)
+
+    def get_tile(self, tile_row, tile_col):
+        key = (tile_row, tile_col)
+
+        # Reuse the tile if it is already cached
+        if key in self.tiles:
+            self.tiles.move_to_end(key)
+            return self.tiles[key]
+
+        tile = self.read_tile(tile_row, tile_col)
+        self.tiles[key] = tile
+
+        # Evict the least recently used tile
+        if len(self.tiles) > self.max_tiles:
+            self.tiles.popitem(last=False)
+
+        return tile
+
+    def sample(self, utm_x, utm_y):
+        # Sample heights at the given UTM coordinates (scalars or arrays)
+        utm_x, utm_y = np.broadcast_arrays(np.asarray(utm_x, dtype=np.float64),
+                                           np.asarray(utm_y, dtype=np.float64))
+        pixel_x, pixel_y = utm_to_pixel(self.transform_inverse, self.raster.width, self.raster.height,
+                                        utm_x.ravel(), utm_y.ravel())
+
+        # Find the tile of every point
+        tile_rows = (pixel_y // self.tile_size).astype(int)
+        tile_cols = (pixel_x // self.tile_size).astype(int)
+        tile_keys = tile_rows * self.tile_cols + tile_cols
+
+        heights = np.empty(pixel_x.shape)
+
+        # Evaluate all points in the same tile at once
+        for key in np.unique(tile_keys):
+            mask = tile_keys == key
+            tile = self.get_tile(key // self.tile_cols, key % self.tile_cols)
+            heights[mask] = tile.ev(pixel_y[mask], pixel_x[mask])
+
+        heights = heights.reshape(utm_x.shape)
+        return heights if heights.ndim else float(heights)
+
+    def close(self):
+        # Close the raster, so that its file can be removed (e.g. on Windows)
+        self.tiles.clear()
+        self.raster.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def get_height_field_path(path_raster, cache_dir):
+    # The cached height field is keyed by the raster's path, modification time and transform
+    with rasterio.open(path_raster) as raster:
+        transform = tuple(raster.transform)[:6]
+    key = f"{os.path.abspath(path_raster)}|{os.path.getmtime(path_raster)}|{transform}"
+    digest = hashlib.sha1(key.encode()).hexdigest()[:16]
+
+    return os.path.join(cache_dir, f"heightfield_{digest}.npy")
+
+def precompute_height_field(path_raster, cache_dir):
+    # One-time preprocessing: compute the bicubic spline coefficients of the
+    # entire raster and store them on disk. Does nothing if already cached.
+    path_field = get_height_field_path(path_raster, cache_dir)
+    if os.path.exists(path_field):
+        return path_field
+
+    print("Precomputing height field...")
+    os.makedirs(cache_dir, exist_ok=True)
+
+    with rasterio.open(path_raster) as raster:
+        data = raster.read(1)
+
+    # Write the coefficients straight to a memory mapped file, then move it
+    # into place so that an interrupted run never leaves a partial cache
+    with atomic_path(path_field) as path_tmp:
+        coefficients = np.lib.format.open_memmap(path_tmp, mode="w+", dtype=np.float64, shape=data.shape)
+        spline_filter(data, order=3, output=coefficients, mode="mirror")
+        coefficients.flush()
+        del coefficients
+
+    print(f"Height field saved to {path_field}")
+    return path_field
+
+class HeightField:
+    # Samples heights from spline coefficients precomputed by precompute_height_field.
+    # The coefficients are memory mapped, so there is no fitting step and only
+    # the pages around the queried points are read from disk.
+
+    def __init__(self, path_raster, cache_dir="height_cache"):
+        with rasterio.open(path_raster) as raster:
+            self.width = raster.width
+            self.height = raster.height
+            self.transform_inverse = ~raster.transform
+
+        path_field = precompute_height_field(path_raster, cache_dir)
+        self.coefficients = np.load(path_field, mmap_mode="r")
+
+    def sample(self, utm_x, utm_y):
+        # Sample heights at the given UTM coordinates (scalars or arrays)
+        utm_x, utm_y = np.broadcast_arrays(np.asarray(utm_x, dtype=np.float64),
+                                           np.asarray(utm_y, dtype=np.float64))
+        pixel_x, pixel_y = utm_to_pixel(self.transform_inverse, self.width, self.height,
+                                        utm_x.ravel(), utm_y.ravel())
+
+        # Evaluate the bicubic spline from its coefficients
+        heights = map_coordinates(self.coefficients, [pixel_y, pixel_x], order=3, mode="mirror", prefilter=False)
+
+        heights = heights.reshape(utm_x.shape)
+        return heights if heights.ndim else float(heights)
+
+    def close(self):
+        # Drop the memory map, so that the cache file can be removed (e.g. on Windows)
+        self.coefficients = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def open_height_map(path_raster, cache_dir=None):
+    # Use the precomputed height field if a cache directory is given,
+    # otherwise read and interpolate tiles on demand. Both can be used with "with"
+    if cache_dir:
+        return HeightField(path_raster, cache_dir)
+    return HeightSampler(path_raster)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("path")
+    parser.add_argument("--cache-dir", default="height_cache")
+
+    args = parser.parse_args()
+    precompute_height_field(args.path, args.cache_dir)
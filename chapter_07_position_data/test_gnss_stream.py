@@ -0,0 +1,71 @@
+from functools import reduce
+import socket
+import threading
+import time
+
+import numpy as np
+import pytest
+
+# gnss_stream publishes through Omniverse, which is only there in its environment
+pytest.importorskip("omni.client")
+
+from gnss_stream import parse_fixes, project_fixes, read_lines, serve_replay, smooth_orientations
+
+def gga(quality="1", lat="6325.0627", lon="01024.2012", alt="45.4", checksum=None):
+    # GGA sentence with a fix at Trondheim, with its checksum unless one is given
+    data = f"GPGGA,123519,{lat},N,{lon},E,{quality},08,0.9,{alt},M,46.9,M,,"
+    if checksum is None:
+        checksum = f"{reduce(lambda a, c: a ^ ord(c), data, 0):02X}"
+    return f"${data}*{checksum}"
+
+class FlatHeightMap:
+    # Same height everywhere, in place of a raster
+    def sample(self, utm_x, utm_y):
+        return 50.0
+
+def test_gga():
+    fixes = list(parse_fixes([gga() + "\r\n"]))
+    assert len(fixes) == 1
+    lat, lon, alt = fixes[0]
+    assert lat == pytest.approx(63 + 25.0627 / 60)
+    assert lon == pytest.approx(10 + 24.2012 / 60)
+    assert alt == 45.4
+
+def test_gga_bad_checksum():
+    assert list(parse_fixes([gga(checksum="00"), gga(checksum="ZZ")])) == []
+
+def test_gga_no_fix():
+    assert list(parse_fixes([gga(quality="0"), gga(quality=""), gga(lat="")])) == []
+
+def test_serve_replay(tmp_path):
+    # Good sentences and CSV rows come through, the rest is skipped
+    path_track = tmp_path / "track.nmea"
+    lines = [gga(), gga(checksum="00"), gga(quality="0"), "63.4172,10.4035,40.0", gga(lat="6325.0700")]
+    path_track.write_text("\n".join(lines) + "\n")
+
+    # A free port for the stand-in receiver, which serves until the test ends
+    with socket.socket() as probe:
+        probe.bind(("localhost", 0))
+        port = probe.getsockname()[1]
+    threading.Thread(target=serve_replay, args=(str(path_track), port, 0), daemon=True).start()
+
+    # Wait for the receiver to listen
+    deadline = time.monotonic() + 5
+    while True:
+        try:
+            socket.create_connection(("localhost", port)).close()
+            break
+        except ConnectionRefusedError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
+    fixes = list(parse_fixes(read_lines(f"tcp://localhost:{port}")))
+    assert len(fixes) == 3
+    assert fixes[1] == (63.4172, 10.4035, 40.0)
+
+    # Every fix becomes a scene position, and orientations follow once the car moves
+    poses = list(smooth_orientations(project_fixes(fixes, FlatHeightMap()), window=1))
+    assert len(poses) == 3
+    assert all(np.isfinite(position).all() for position, _ in poses)
+    assert poses[0][1] is None and poses[2][1] is not None
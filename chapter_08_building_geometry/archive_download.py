@@ -0,0 +1,144 @@
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import os
+import re
+import shutil
+import threading
+import time
+import zipfile
+import zlib
+
+import requests
+
+def download_archive(url, path_zip, session=None, chunk_size=1 << 20, retries=5):
+    # Stream the archive to disk in chunks. An interrupted transfer is resumed
+    # from where it stopped with an HTTP Range request, instead of starting over.
+    # The ETag of the archive is kept next to the .part file and sent as If-Range,
+    # so that a part of another archive (e.g. an older export) is never resumed
+    http = session or requests
+    path_part = f"{path_zip}.part"
+    path_etag = f"{path_part}.etag"
+
+    # Without a known ETag, a part file cannot be matched to the archive
+    etag = None
+    if os.path.exists(path_etag):
+        with open(path_etag) as file_etag:
+            etag = file_etag.read()
+
+    # ETag of the archive as first sent in this download
+    etag_download = None
+
+    for attempt in range(retries + 1):
+        offset = os.path.getsize(path_part) if etag and os.path.exists(path_part) else 0
+        headers = {"Range": f"bytes={offset}-", "If-Range": etag} if offset else {}
+
+        try:
+            with http.get(url, headers=headers, stream=True, timeout=60) as response:
+                # The part file already holds the entire archive
+                if response.status_code == 416:
+                    break
+                response.raise_for_status()
+
+                # The archive must not change between the attempts of one download
+                etag_response = response.headers.get("ETag")
+                if etag_download and etag_response != etag_download:
+                    raise ValueError(f"Archive changed during the download: {url}")
+                etag_download = etag_response
+
+                # Start over if the part file belongs to another archive, or the server
+                # ignored the Range header. The new ETag is recorded before any data
+                if response.status_code != 206:
+                    offset = 0
+                    etag = etag_response
+                    if etag:
+                        with open(path_etag, "w") as file_etag:
+                            file_etag.write(etag)
+                    elif os.path.exists(path_etag):
+                        os.remove(path_etag)
+                elif offset:
+                    print(f"Resuming download at {offset} bytes...")
+
+                with open(path_part, "ab" if offset else "wb") as file_part:
+                    for chunk in response.iter_content(chunk_size):
+                        file_part.write(chunk)
+            break
+        except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError):
+            if attempt == retries:
+                raise
+            print("Download interrupted! Retrying...")
+            time.sleep(2 ** attempt)
+
+    verify_checksum(path_part, etag)
+    os.replace(path_part, path_zip)
+    if os.path.exists(path_etag):
+        os.remove(path_etag)
+
+def verify_checksum(path, etag):
+    # Single-part S3 uploads have the MD5 of the file as their ETag.
+    # Other ETags (e.g. multipart uploads) cannot be checked this way
+    etag = (etag or "").strip('"')
+    if not re.fullmatch(r"[0-9a-f]{32}", etag):
+        return
+
+    md5 = hashlib.md5()
+    with open(path, "rb") as file_download:
+        for chunk in iter(lambda: file_download.read(1 << 20), b""):
+            md5.update(chunk)
+
+    if md5.hexdigest() != etag:
+        # Do not resume from a corrupt file on the next attempt
+        os.remove(path)
+        raise ValueError(f"Checksum mismatch for {path}")
+
+def file_matches(path, info):
+    # Whether an already extracted file has the same size and CRC as the archive member
+    if not os.path.isfile(path) or os.path.getsize(path) != info.file_size:
+        return False
+
+    crc = 0
+    with open(path, "rb") as file_existing:
+        for chunk in iter(lambda: file_existing.read(1 << 20), b""):
+            crc = zlib.crc32(chunk, crc)
+
+    return crc == info.CRC
+
+def extract_archive(path_zip, path, workers=8, rename=None):
+    # Extract all members in parallel, skipping files that are already up to date.
+    # rename maps a member name to the path it is extracted to, relative to path.
+    # Returns the relative paths of all members
+    with zipfile.ZipFile(path_zip) as archive:
+        members = [info for info in archive.infolist() if not info.is_dir()]
+
+    # Member names come from the server, so they must stay within the target folder
+    names = [rename(info.filename) if rename else info.filename for info in members]
+    for name in names:
+        if os.path.isabs(name) or ".." in re.split(r"[/\\]", name):
+            raise ValueError(f"Unsafe member name {name} in {path_zip}")
+
+    # Create the folders up front, as threads creating the same folder at once would fail
+    for directory in {os.path.dirname(name) for name in names}:
+        os.makedirs(os.path.join(path, directory), exist_ok=True)
+
+    # ZipFile objects are not safe to share between threads, so every thread opens its own
+    local = threading.local()
+    archives = []
+
+    def extract(info, name):
+        path_file = os.path.join(path, name)
+        if file_matches(path_file, info):
+            return False
+        if not hasattr(local, "archive"):
+            local.archive = zipfile.ZipFile(path_zip)
+            archives.append(local.archive)
+        with local.archive.open(info) as member, open(path_file, "wb") as file_extracted:
+            shutil.copyfileobj(member, file_extracted, 1 << 20)
+        return True
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        extracted = sum(executor.map(extract, members, names))
+
+    for archive in archives:
+        archive.close()
+
+    print(f"Extracted {extracted} files, {len(members) - extracted} already up to date")
+    return names
@@ -0,0 +1,107 @@
+import asyncio
+import json
+import math
+import os
+import time
+
+from shapely.geometry import Polygon, box
+
+from archive_download import download_archive, extract_archive
+from export_cache import lookup, store
+from file_utils import atomic_path
+
+# Folder holding the downloaded archive and the list of extracted files of every tile
+TILES_DIR = "tiles"
+
+def split_polygon(coords, tile_size=500):
+    # Split a polygon into the parts that fall within each cell of a grid.
+    # The grid is aligned to multiples of the tile size, so tiles are stable between runs
+    polygon = Polygon(coords)
+    minx, miny, maxx, maxy = polygon.bounds
+
+    tiles = []
+    for i in range(math.floor(minx / tile_size), math.ceil(maxx / tile_size)):
+        for j in range(math.floor(miny / tile_size), math.ceil(maxy / tile_size)):
+            cell = box(i * tile_size, j * tile_size, (i + 1) * tile_size, (j + 1) * tile_size)
+            part = polygon.intersection(cell)
+
+            # A cell may cut the polygon into several pieces
+            pieces = [geom for geom in getattr(part, "geoms", [part]) if geom.geom_type == "Polygon" and geom.area > 0]
+            for k, piece in enumerate(pieces):
+                tile_id = f"tile_{i}_{j}" if len(pieces) == 1 else f"tile_{i}_{j}_{k}"
+                tiles.append((tile_id, [list(c) for c in piece.exterior.coords]))
+
+    return tiles
+
+async def submit_tiles(tiles, projection, content, formats, epost, client, navn="script_test_2",
+                       max_concurrent=4, min_interval=1.0):
+    # Submit one job per tile concurrently, with at most max_concurrent requests
+    # in flight and at least min_interval seconds between submissions
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(max_concurrent)
+    rate_lock = asyncio.Lock()
+    last_submit = [0.0]
+
+    async def submit(tile_id, coords):
+        async with semaphore:
+            async with rate_lock:
+                delay = last_submit[0] + min_interval - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                last_submit[0] = time.monotonic()
+
+            jobid = await loop.run_in_executor(None, client.submit_job, coords, projection, content, formats,
+                                               epost, f"{navn}_{tile_id}")
+            return tile_id, jobid
+
+    return dict(await asyncio.gather(*(submit(tile_id, coords) for tile_id, coords in tiles)))
+
+def get_merged_name(tile_id, name):
+    # Where a file of a tile's export goes in the merged tree. Every top-level folder
+    # (e.g. wavefrontobj) gets a subfolder per tile, as each tile comes with its own
+    # transformation matrix (global.fwt). Top-level files get the tile as prefix
+    top, _, rest = name.partition("/")
+    if rest:
+        return f"{top}/{tile_id}/{rest}"
+    return f"{tile_id}_{top}"
+
+def extract_tile(path_zip, tile_id, path="buildings", tiles_dir=TILES_DIR):
+    # Extract the export of a tile straight into the merged tree, so that files that are
+    # already up to date are skipped. Files of an earlier export of the tile that are not
+    # in this one are removed
+    print(f"Extracting {tile_id}...")
+    names = extract_archive(path_zip, path, rename=lambda name: get_merged_name(tile_id, name))
+
+    path_record = os.path.join(tiles_dir, f"{tile_id}.json")
+    if os.path.exists(path_record):
+        with open(path_record) as f:
+            names_before = json.load(f)
+        for name in set(names_before) - set(names):
+            path_removed = os.path.join(path, name)
+            if os.path.exists(path_removed):
+                os.remove(path_removed)
+
+    os.makedirs(tiles_dir, exist_ok=True)
+    with atomic_path(path_record) as path_tmp, open(path_tmp, "w") as f:
+        json.dump(names, f)
+
+def restore_tile(key, tile_id, path="buildings", tiles_dir=TILES_DIR):
+    # Extract a tile from the export cache, if the same export was downloaded before
+    path_zip = lookup(key)
+    if path_zip is None:
+        return False
+    extract_tile(path_zip, tile_id, path, tiles_dir)
+    return True
+
+def download_tile(url, key, tile_id, session=None, path="buildings", tiles_dir=TILES_DIR):
+    # Download the export of a tile, add it to the export cache and extract it
+    os.makedirs(tiles_dir, exist_ok=True)
+    path_zip = os.path.join(tiles_dir, f"{tile_id}.zip")
+
+    print(f"Downloading {tile_id}...")
+    download_archive(url, path_zip, session)
+    store(key, path_zip)
+    extract_tile(path_zip, tile_id, path, tiles_dir)
+
+    # The archive is kept in the export cache
+    os.remove(path_zip)
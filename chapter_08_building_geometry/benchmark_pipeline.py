@@ -0,0 +1,76 @@
+import argparse
+import os
+import tempfile
+
+from imap_watcher import DownloadLinkWatcher
+from mock_services import MockServices
+from restapi_buildings import GeodataClient
+from restapi_all import run_pipeline
+
+# Stages of restapi_all.run_pipeline, in order
+STAGES = ["token", "cache", "submit", "jobs", "convert", "sync"]
+
+def square(center, size):
+    x, y = center
+    h = size / 2
+    return [[x - h, y - h], [x + h, y - h], [x + h, y + h], [x - h, y + h], [x - h, y - h]]
+
+def run_benchmark(services, coords, tile_size, initial_delay):
+    # The pipeline of restapi_all.main up to the scene import, against the stand-in services
+    timings = {}
+    epost = "benchmark@example.com"
+    client = GeodataClient("benchmark", "password", path_key="missing.key", url=services.url)
+
+    def open_watcher():
+        return DownloadLinkWatcher(epost, "password", services.host, services.imap_port, use_ssl=False,
+                                   url_pattern=services.url_pattern)
+
+    if not run_pipeline(client, coords, epost, open_watcher, "nucleus/cache", "nucleus", tile_size,
+                        min_interval=0, initial_delay=initial_delay, max_delay=initial_delay * 4, poll_interval=1,
+                        on_stage=timings.__setitem__):
+        raise RuntimeError("Pipeline failed")
+    return timings
+
+def run_benchmarks(services, coords, tile_size, initial_delay, runs):
+    # The pipeline works in the current folder, so every benchmark gets a temporary one.
+    # Runs share it, to measure the caches. The folder is changed back even on failure
+    path_cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as path_tmp:
+        try:
+            os.chdir(path_tmp)
+            return [run_benchmark(services, coords, tile_size, initial_delay) for _ in range(runs)]
+        finally:
+            os.chdir(path_cwd)
+
+def report(results):
+    print(f"\n{'run':<6}" + "".join(f"{name:>9}" for name in STAGES) + f"{'total':>9}")
+    for run, timings in enumerate(results, 1):
+        print(f"{run:<6}" + "".join(f"{timings[name]:>9.2f}" for name in STAGES) + f"{sum(timings.values()):>9.2f}")
+    print("(seconds)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=2, help="Runs in the same folder, to measure the caches")
+    parser.add_argument("--area", type=float, default=1000, help="Width and height of the exported area in meters")
+    parser.add_argument("--tile-size", type=float, default=500, help="Tile size in meters")
+    parser.add_argument("--buildings", type=int, default=100, help="Buildings per exported tile")
+    parser.add_argument("--job-duration", type=float, default=5.0, help="Seconds until a job has finished")
+    parser.add_argument("--email-delay", type=float, default=1.0, help="Seconds from a finished job to its email")
+    parser.add_argument("--submit-delay", type=float, default=0.5, help="Seconds per submitJob request")
+    parser.add_argument("--status-delay", type=float, default=0.1, help="Seconds per job status request")
+    parser.add_argument("--token-delay", type=float, default=0.2, help="Seconds per generateToken request")
+    parser.add_argument("--download-rate", type=float, default=None, help="Download bandwidth in bytes/s")
+    parser.add_argument("--initial-delay", type=float, default=1.0, help="Initial delay between status requests")
+    args = parser.parse_args()
+
+    services = MockServices(args.token_delay, args.submit_delay, args.status_delay, args.job_duration,
+                            args.email_delay, download_rate=args.download_rate, buildings=args.buildings)
+    coords = square((270630.0, 7040355.0), args.area)
+
+    try:
+        results = run_benchmarks(services, coords, args.tile_size, args.initial_delay, args.runs)
+    finally:
+        services.close()
+
+    report(results)
+    print(f"Requests: {services.requests}")
@@ -0,0 +1,46 @@
+import hashlib
+import json
+import os
+import shutil
+
+from file_utils import atomic_path
+
+# Folder holding the archive of one export per request
+CACHE_DIR = "export_cache"
+
+def canonical_polygon(coords, ndigits=2):
+    # Round the coordinates and drop the closing vertex, then start the ring at its
+    # smallest vertex and orient it counter-clockwise, so the same area always gives
+    # the same list of coordinates
+    ring = [(round(float(x), ndigits), round(float(y), ndigits)) for x, y in coords]
+    if len(ring) > 1 and ring[0] == ring[-1]:
+        ring = ring[:-1]
+
+    area = sum(x0 * y1 - x1 * y0 for (x0, y0), (x1, y1) in zip(ring, ring[1:] + ring[:1]))
+    if area < 0:
+        ring = ring[::-1]
+
+    start = ring.index(min(ring))
+    return ring[start:] + ring[:start]
+
+def export_key(coords, projection, content, formats):
+    # Hash of the arguments of submit_job that decide what the export contains
+    request = {
+        "polygon": canonical_polygon(coords),
+        "projection": projection,
+        "innhold": sorted(content),
+        "format": sorted(formats)
+    }
+    return hashlib.sha256(json.dumps(request, sort_keys=True, separators=(",", ":")).encode()).hexdigest()
+
+def lookup(key, cache_dir=CACHE_DIR):
+    # Path of the cached archive of an export. An entry only exists once it has been stored completely
+    path_entry = os.path.join(cache_dir, f"{key}.zip")
+    return path_entry if os.path.isfile(path_entry) else None
+
+def store(key, path_zip, cache_dir=CACHE_DIR):
+    # Add a downloaded export archive to the cache. It is copied to a temporary file first
+    # and renamed when complete, so an interrupted run never leaves a partial entry
+    os.makedirs(cache_dir, exist_ok=True)
+    with atomic_path(os.path.join(cache_dir, f"{key}.zip")) as path_tmp:
+        shutil.copyfile(path_zip, path_tmp)
@@ -0,0 +1,95 @@
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import json
+import os
+import shutil
+
+from file_utils import atomic_path
+
+# Suffix of the manifest kept next to every synced destination, outside the synced tree
+MANIFEST = ".sync_manifest.json"
+
+def hash_file(path):
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+def load_manifest(path_manifest):
+    if not os.path.exists(path_manifest):
+        return {}
+    with open(path_manifest) as f:
+        return json.load(f)
+
+def save_manifest(manifest, path_manifest):
+    # Write to a temporary file first, so the manifest is never left half written
+    with atomic_path(path_manifest) as path_tmp, open(path_tmp, "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+
+def sync_file(path_src, path_dst, entry):
+    # Bring one file up to date. Returns its new manifest entry, and whether it was copied
+    stat = os.stat(path_src)
+    dst_exists = os.path.exists(path_dst)
+
+    # Same size and modification time as last time: assume the file is unchanged
+    if entry and dst_exists and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+        return entry, False
+
+    # Touched, but with the same content (e.g. extracted again)
+    sha256 = hash_file(path_src)
+    new_entry = {"size": stat.st_size, "mtime": stat.st_mtime, "sha256": sha256}
+    if entry and dst_exists and entry["sha256"] == sha256:
+        return new_entry, False
+
+    os.makedirs(os.path.dirname(path_dst), exist_ok=True)
+    shutil.copy2(path_src, path_dst)
+    return new_entry, True
+
+def get_manifest_path(path_dst):
+    # e.g. buildings.sync_manifest.json for the destination buildings
+    return os.path.normpath(path_dst) + MANIFEST
+
+def remove_empty_dirs(path, path_root):
+    # Remove a directory and its parents while they are empty, up to (not including) the root
+    path_root = os.path.normpath(path_root)
+    path = os.path.normpath(path)
+    while path != path_root and os.path.isdir(path) and not os.listdir(path):
+        os.rmdir(path)
+        path = os.path.dirname(path)
+
+def sync_tree(path_src, path_dst, workers=8):
+    # Copy only the files that changed since the last sync, several at a time.
+    # Files that were synced before but are gone from the source are removed,
+    # along with the directories that leaves empty
+    path_manifest = get_manifest_path(path_dst)
+    manifest = load_manifest(path_manifest)
+
+    # Earlier syncs kept the manifest inside the destination. Take it over once
+    path_old_manifest = os.path.join(path_dst, MANIFEST)
+    if os.path.exists(path_old_manifest):
+        manifest = manifest or load_manifest(path_old_manifest)
+        os.remove(path_old_manifest)
+
+    files = [os.path.relpath(os.path.join(root, f), path_src) for root, _, names in os.walk(path_src) for f in names]
+    files = [f.replace(os.sep, "/") for f in files]
+
+    def sync(f):
+        return sync_file(os.path.join(path_src, f), os.path.join(path_dst, f), manifest.get(f))
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(sync, files))
+
+    removed = set(manifest) - set(files)
+    for f in removed:
+        path_removed = os.path.join(path_dst, f)
+        if os.path.exists(path_removed):
+            os.remove(path_removed)
+        remove_empty_dirs(os.path.dirname(path_removed), path_dst)
+
+    os.makedirs(path_dst, exist_ok=True)
+    save_manifest({f: entry for f, (entry, _) in zip(files, results)}, path_manifest)
+
+    copied = sum(copied for _, copied in results)
+    print(f"Copied {copied} files, {len(files) - copied} unchanged, {len(removed)} removed")
+    return copied
@@ -0,0 +1,183 @@
+import email
+import imaplib
+import re
+import select
+import threading
+import time
+
+# Sender of the Geodata Online notification emails, and the download links they contain
+SENDER = "Geodataonline@geodata.no"
+URL_PATTERN = r"https://geodata-gdonline-gdo-processing-geoprocessing\.s3\.amazonaws\.com/gpresults/3DClipAndShip/[^\s\"'<>]*"
+
+class DownloadLinkWatcher:
+    # Watches an IMAP inbox for the download links of finished jobs. Only unseen emails
+    # from the Geodata sender are searched, and only their headers and text parts are
+    # fetched. Links are matched to job IDs (or job names), so concurrent jobs each get
+    # their own link. Several threads can wait for links at the same time.
+
+    def __init__(self, epost, password, host="imap.gmail.com", port=993, use_ssl=True,
+                 sender=SENDER, url_pattern=URL_PATTERN):
+        self.sender = sender
+        self.url_pattern = re.compile(url_pattern)
+
+        print("Logging into email account...")
+        self.imap = imaplib.IMAP4_SSL(host, port) if use_ssl else imaplib.IMAP4(host, port)
+        self.imap.login(epost, password)
+        self.imap.select("INBOX")
+        self.supports_idle = "IDLE" in self.imap.capabilities
+        print("Logged in.")
+
+        # Links found so far, and the jobs (with their names) that are expected or waiting
+        self.urls = {}
+        self.unmatched = []
+        self.expected = {}
+        self.waiting = {}
+
+        # Only one thread talks to the server at a time
+        self.condition = threading.Condition()
+        self.polling = False
+        self.idle_count = 0
+
+    def close(self):
+        self.imap.logout()
+
+    def expect(self, jobid, name=None):
+        # Register a submitted job, so that its link is recognized even if the email
+        # arrives before anyone is waiting for it
+        with self.condition:
+            self.expected[jobid] = name
+
+    def fetch_text(self, msg_id):
+        # Fetch the headers needed to decode the message, without the body
+        header = self.imap.fetch(msg_id, "(BODY.PEEK[HEADER.FIELDS (FROM SUBJECT MIME-VERSION CONTENT-TYPE CONTENT-TRANSFER-ENCODING)])")[1][0][1]
+        msg = email.message_from_bytes(header)
+
+        if msg.get_content_maintype() == "multipart":
+            # Only fetch the first part, which holds the text of the email
+            response = self.imap.fetch(msg_id, "(BODY.PEEK[1.MIME] BODY.PEEK[1])")[1]
+            msg = email.message_from_bytes(response[0][1] + response[1][1])
+        else:
+            text = self.imap.fetch(msg_id, "(BODY.PEEK[TEXT])")[1][0][1]
+            msg = email.message_from_bytes(header + text)
+
+        # Collect all text parts (the first part may itself be multipart/alternative)
+        texts = [msg["Subject"] or ""]
+        for part in msg.walk():
+            if part.get_content_maintype() == "text":
+                payload = part.get_payload(decode=True) or b""
+                texts.append(payload.decode(part.get_content_charset() or "utf-8", errors="replace"))
+
+        return "\n".join(texts)
+
+    def match_job(self, text):
+        # Find the job an email belongs to, by its job ID or job name
+        for jobid, name in {**self.expected, **self.waiting}.items():
+            if jobid is None:
+                continue
+            if jobid in text:
+                return jobid
+            if name and re.search(re.escape(name) + r"(?!\w)", text):
+                return jobid
+        return None
+
+    def check_inbox(self):
+        # Search for unseen emails from the Geodata sender only
+        msg_ids = self.imap.search(None, "FROM", f'"{self.sender}"', "UNSEEN")[1][0].split()
+
+        for msg_id in msg_ids:
+            text = self.fetch_text(msg_id)
+
+            # Emails without a link, e.g. the job start confirmations, are skipped
+            url = self.url_pattern.search(text)
+            if url:
+                jobid = self.match_job(text)
+                if jobid:
+                    self.urls[jobid] = url.group(0)
+                else:
+                    self.unmatched.append(url.group(0))
+
+            self.imap.store(msg_id, "+FLAGS", "\\Seen")
+
+        # Links that could not be matched go to a caller waiting for any link,
+        # or to the only job that is still missing its link
+        missing = [jobid for jobid in {**self.expected, **self.waiting} if jobid not in self.urls]
+        if self.unmatched and None in self.waiting and None not in self.urls:
+            self.urls[None] = self.unmatched.pop(0)
+        elif self.unmatched and len(missing) == 1 and missing[0] in self.waiting:
+            self.urls[missing[0]] = self.unmatched.pop(0)
+
+    def has_data(self, timeout):
+        # Whether the server sent something within the timeout. Only the public socket is
+        # watched, so a response that imaplib (or TLS) already buffered is not seen here.
+        # It is then read once the timeout has run out, so new emails are only found late
+        return bool(select.select([self.imap.socket()], [], [], timeout)[0])
+
+    def idle(self, timeout):
+        # Wait for new emails with IDLE, or simply wait if the server does not support it
+        if not self.supports_idle:
+            time.sleep(timeout)
+            return
+
+        # Tags only need to differ from those of other running commands, and imaplib runs
+        # none meanwhile. Its own tags are upper case, so lower case ones never collide
+        self.idle_count += 1
+        tag = f"idle{self.idle_count}".encode()
+        self.imap.send(tag + b" IDLE\r\n")
+
+        # Changes can be reported before the server confirms it is idling
+        changed = False
+        line = self.imap.readline()
+        while not line.startswith(b"+"):
+            if line.startswith(tag + b" "):
+                raise imaplib.IMAP4.error(f"IDLE failed: {line.decode(errors='replace').strip()}")
+            changed = True
+            line = self.imap.readline()
+
+        # Wait until the server reports a change to the mailbox, or the timeout runs out
+        if not changed and self.has_data(timeout):
+            self.imap.readline()
+
+        self.imap.send(b"DONE\r\n")
+        while not self.imap.readline().startswith(tag + b" "):
+            pass
+
+    def wait_for_url(self, jobid=None, name=None, timeout=None, poll_interval=60):
+        # Wait for the download link of a job. Without a job ID, the first link found is returned.
+        # The inbox is checked again every poll_interval seconds (or when IDLE reports new emails),
+        # until the link is found or the timeout runs out
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        with self.condition:
+            self.waiting[jobid] = name
+            try:
+                while jobid not in self.urls:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        raise TimeoutError(f"No download link for job {jobid} within {timeout} s")
+
+                    # Another thread is already talking to the server
+                    if self.polling:
+                        self.condition.wait(remaining)
+                        continue
+
+                    self.polling = True
+                    try:
+                        print("Checking inbox for download links...")
+                        self.check_inbox()
+
+                        # Let other threads register their jobs while waiting for new emails
+                        if jobid not in self.urls:
+                            self.condition.release()
+                            try:
+                                self.idle(poll_interval if remaining is None else min(poll_interval, remaining))
+                            finally:
+                                self.condition.acquire()
+                    finally:
+                        self.polling = False
+                        self.condition.notify_all()
+            finally:
+                del self.waiting[jobid]
+
+            self.expected.pop(jobid, None)
+            print("Email received!")
+            return self.urls.pop(jobid)
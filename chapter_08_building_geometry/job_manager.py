@@ -0,0 +1,30 @@
+import asyncio
+
+from restapi_buildings import STATII, backoff_delays
+
+async def wait_for_job(jobid, client, initial_delay=5, max_delay=120):
+    # Poll the status of a job on an adaptive backoff schedule, without blocking the event loop
+    loop = asyncio.get_running_loop()
+    status = ""
+
+    for delay in backoff_delays(initial_delay, maximum=max_delay):
+        status = await loop.run_in_executor(None, client.get_job_status, jobid)
+        if status in STATII:
+            break
+        await asyncio.sleep(delay)
+
+    print(f"Job {jobid}: {status}")
+    return status == "esriJobSucceeded"
+
+async def run_jobs(jobids, client, on_complete, initial_delay=5, max_delay=120):
+    # Track many jobs at once. As soon as a job has finished, its ID and whether it
+    # succeeded are handed to on_complete (a blocking function, e.g. the download stage),
+    # while the other jobs are still being polled
+    loop = asyncio.get_running_loop()
+
+    async def track(jobid):
+        succeeded = await wait_for_job(jobid, client, initial_delay, max_delay)
+        result = await loop.run_in_executor(None, on_complete, jobid, succeeded)
+        return jobid, result
+
+    return dict(await asyncio.gather(*(track(jobid) for jobid in jobids)))
@@ -0,0 +1,316 @@
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+import email
+import email.policy
+import hashlib
+import io
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import re
+import select
+import socketserver
+import threading
+import time
+import uuid
+from urllib.parse import parse_qs, urlparse
+import zipfile
+
+from imap_watcher import SENDER
+
+# Local stand-ins for the Geodata Online REST services, the Gmail inbox that receives
+# the notification emails and the S3 bucket the exports are downloaded from. Server-side
+# delays are configurable, so the pipeline can be timed offline.
+
+def create_export(buildings=100, texture_size=65536):
+    # A zip file laid out like a ClipAndShip export: one OBJ with a box per building,
+    # its material file, a texture per material and the transformation matrix
+    obj = ["# Mock export\n", "mtllib uvmapping.mtl\n"]
+    mtl = ["# Mock materials\n"]
+    for b in range(buildings):
+        x, z = (b % 10) * 20.0, (b // 10) * 20.0
+        for dx, dy, dz in [(0, 0, 0), (10, 0, 0), (10, 0, 10), (0, 0, 10), (0, 15, 0), (10, 15, 0), (10, 15, 10), (0, 15, 10)]:
+            obj.append(f"v {x + dx} {dy} {z + dz}\n")
+        obj.append(f"usemtl roof_{b}\n")
+        v = b * 8
+        for face in [(5, 6, 7, 8), (1, 2, 6, 5), (2, 3, 7, 6), (3, 4, 8, 7), (4, 1, 5, 8)]:
+            obj.append("f " + " ".join(str(v + i) for i in face) + "\n")
+        mtl.append(f"newmtl roof_{b}\nKa 1 1 1\nKd 1 1 1\nmap_Kd roof_{b}.jpg\n\n")
+
+    transform = "1 0 0 270630.659\n0 1 0 7040355.576\n0 0 1 46.670\n0 0 0 1\n"
+
+    data = io.BytesIO()
+    with zipfile.ZipFile(data, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("wavefrontobj/uvmapping/uvmapping.obj", "".join(obj))
+        archive.writestr("wavefrontobj/uvmapping/uvmapping.mtl", "".join(mtl))
+        archive.writestr("wavefrontobj/uvmapping/global.fwt", transform)
+        for b in range(buildings):
+            # Incompressible, like real JPEG textures
+            archive.writestr(f"wavefrontobj/uvmapping/roof_{b}.jpg", hashlib.sha256(str(b).encode()).digest() * (texture_size // 32),
+                             compress_type=zipfile.ZIP_STORED)
+    return data.getvalue()
+
+def create_notification(navn, jobid, url):
+    # Multipart email with the download link, like the one sent when a job has finished
+    msg = MIMEMultipart()
+    msg["From"] = SENDER
+    msg["Subject"] = f"Geodata Online - eksport {navn} er klar"
+    msg.attach(MIMEText(f"Eksporten {navn} (jobb {jobid}) er ferdig.\n\nLast ned her: {url}\n", "plain", "utf-8"))
+    msg.attach(MIMEText(f"<p>Eksporten {navn} er ferdig. <a href=\"{url}\">Last ned</a></p>", "html", "utf-8"))
+    return msg.as_bytes(policy=email.policy.SMTP)
+
+class Mailbox:
+    # In-memory inbox shared by all IMAP connections
+    def __init__(self):
+        self.messages = []
+        self.seen = set()
+        self.lock = threading.Lock()
+
+    def add(self, msg_bytes):
+        with self.lock:
+            self.messages.append(msg_bytes)
+
+    def count(self):
+        with self.lock:
+            return len(self.messages)
+
+class IMAPHandler(socketserver.StreamRequestHandler):
+    # Just enough of IMAP4rev1 for the download link watcher
+    mailbox = None
+
+    def send(self, line):
+        self.wfile.write(line if isinstance(line, bytes) else line.encode())
+
+    def handle(self):
+        self.send("* OK IMAP4rev1 stand-in ready\r\n")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            tag, command, *rest = line.decode().rstrip("\r\n").split(" ", 2)
+            args = rest[0] if rest else ""
+            command = command.upper()
+
+            if command == "CAPABILITY":
+                self.send("* CAPABILITY IMAP4rev1 IDLE\r\n")
+            elif command == "SELECT":
+                self.send(f"* {self.mailbox.count()} EXISTS\r\n")
+            elif command == "SEARCH":
+                self.search(args)
+            elif command == "FETCH":
+                self.fetch(args)
+            elif command == "STORE":
+                with self.mailbox.lock:
+                    self.mailbox.seen.add(int(args.split()[0]))
+            elif command == "IDLE":
+                self.idle()
+            elif command == "LOGOUT":
+                self.send("* BYE\r\n")
+                self.send(f"{tag} OK LOGOUT completed\r\n")
+                return
+            self.send(f"{tag} OK {command} completed\r\n")
+
+    def search(self, args):
+        sender = re.search(r'FROM "([^"]*)"', args)
+        ids = []
+        with self.mailbox.lock:
+            for i, msg_bytes in enumerate(self.mailbox.messages, 1):
+                msg = email.message_from_bytes(msg_bytes)
+                if sender and sender.group(1) not in (msg["From"] or ""):
+                    continue
+                if "UNSEEN" in args and i in self.mailbox.seen:
+                    continue
+                ids.append(str(i))
+        self.send(f"* SEARCH {' '.join(ids)}\r\n")
+
+    def fetch(self, args):
+        msg_id, items = args.split(" ", 1)
+        with self.mailbox.lock:
+            msg_bytes = self.mailbox.messages[int(msg_id) - 1]
+        msg = email.message_from_bytes(msg_bytes)
+        _, _, body = msg_bytes.partition(b"\r\n\r\n")
+
+        parts = []
+        for item in re.findall(r"BODY\.PEEK\[([^\]]*)\]", items):
+            if item.startswith("HEADER.FIELDS"):
+                names = re.search(r"\((.*)\)", item).group(1).lower().split()
+                data = b"".join(f"{k}: {v}\r\n".encode() for k, v in msg.items() if k.lower() in names) + b"\r\n"
+            elif item in ("1", "1.MIME") and msg.is_multipart():
+                part_header, _, part_body = msg.get_payload(0).as_bytes().replace(b"\n", b"\r\n").partition(b"\r\n\r\n")
+                data = part_header + b"\r\n\r\n" if item == "1.MIME" else part_body
+            elif item in ("1", "TEXT"):
+                data = body
+            else:
+                data = msg_bytes
+            parts.append(f"BODY[{item}] {{{len(data)}}}\r\n".encode() + data)
+
+        self.send(f"* {msg_id} FETCH (".encode() + b" ".join(parts) + b")\r\n")
+
+    def idle(self):
+        # Report new messages until the client ends the IDLE command
+        self.send("+ idling\r\n")
+        count = self.mailbox.count()
+        while True:
+            if self.mailbox.count() != count:
+                count = self.mailbox.count()
+                self.send(f"* {count} EXISTS\r\n")
+            if select.select([self.request], [], [], 0.05)[0]:
+                self.rfile.readline()
+                return
+
+class GeodataHandler(BaseHTTPRequestHandler):
+    # generateToken, submitJob, job status and the S3 download, on one server
+    protocol_version = "HTTP/1.1"
+    services = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, response):
+        body = json.dumps(response).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        params = {k: v[0] for k, v in parse_qs(self.rfile.read(length).decode()).items()}
+        path = urlparse(self.path).path
+
+        if path.endswith("/tokens/generateToken"):
+            self.send_json(self.services.generate_token(params))
+        elif path.endswith("/submitJob"):
+            self.send_json(self.services.submit_job(params))
+        else:
+            self.send_error(404)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+
+        if "/jobs/" in url.path:
+            self.send_json(self.services.job_status(url.path.rsplit("/", 1)[1], params))
+        elif url.path.startswith("/gpresults/"):
+            self.send_archive()
+        else:
+            self.send_error(404)
+
+    def send_archive(self):
+        services = self.services
+        time.sleep(services.download_delay)
+        data = services.export
+
+        # Resume from the requested offset, like S3. The Range header is ignored
+        # if If-Range names another version of the archive
+        offset = 0
+        match = re.match(r"bytes=(\d+)-", self.headers.get("Range", ""))
+        if self.headers.get("If-Range", f'"{services.etag}"') != f'"{services.etag}"':
+            match = None
+        if match and int(match.group(1)) >= len(data):
+            self.send_response(416)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if match:
+            offset = int(match.group(1))
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {offset}-{len(data) - 1}/{len(data)}")
+        else:
+            self.send_response(200)
+
+        self.send_header("Content-Type", "application/zip")
+        self.send_header("Content-Length", str(len(data) - offset))
+        self.send_header("ETag", f'"{services.etag}"')
+        self.end_headers()
+
+        # Limit the bandwidth, if set
+        chunk_size = 1 << 16
+        for start in range(offset, len(data), chunk_size):
+            self.wfile.write(data[start:start + chunk_size])
+            if services.download_rate:
+                time.sleep(chunk_size / services.download_rate)
+
+class MockServices:
+    def __init__(self, token_delay=0.2, submit_delay=0.5, status_delay=0.1, job_duration=5.0, email_delay=1.0,
+                 download_delay=0.1, download_rate=None, buildings=100, host="127.0.0.1"):
+        self.token_delay = token_delay
+        self.submit_delay = submit_delay
+        self.status_delay = status_delay
+        self.job_duration = job_duration
+        self.email_delay = email_delay
+        self.download_delay = download_delay
+        self.download_rate = download_rate
+
+        self.export = create_export(buildings)
+        self.etag = hashlib.md5(self.export).hexdigest()
+        self.tokens = set()
+        self.jobs = {}
+        self.timers = []
+        self.lock = threading.Lock()
+
+        # Number of requests per endpoint, to compare runs
+        self.requests = {"generateToken": 0, "submitJob": 0, "status": 0}
+
+        handler_http = type("Handler", (GeodataHandler,), {"services": self})
+        self.http = ThreadingHTTPServer((host, 0), handler_http)
+        self.mailbox = Mailbox()
+        handler_imap = type("Handler", (IMAPHandler,), {"mailbox": self.mailbox})
+        self.imap = socketserver.ThreadingTCPServer((host, 0), handler_imap)
+        self.imap.daemon_threads = True
+
+        for server in (self.http, self.imap):
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        self.host = host
+        self.base_url = f"http://{host}:{self.http.server_address[1]}"
+        self.imap_port = self.imap.server_address[1]
+
+        # Pass instead of GEODATA_URL and URL_PATTERN (to GeodataClient and DownloadLinkWatcher)
+        self.url = f"{self.base_url}/arcgis"
+        self.url_pattern = re.escape(self.base_url) + r"/gpresults/3DClipAndShip/[^\s\"'<>]*"
+
+    def close(self):
+        for timer in self.timers:
+            timer.cancel()
+        for server in (self.http, self.imap):
+            server.shutdown()
+            server.server_close()
+
+    def generate_token(self, params):
+        time.sleep(self.token_delay)
+        with self.lock:
+            self.requests["generateToken"] += 1
+            token = uuid.uuid4().hex
+            self.tokens.add(token)
+        return {"token": token, "expires": int((time.time() + int(params.get("expiration", 60)) * 60) * 1000)}
+
+    def submit_job(self, params):
+        time.sleep(self.submit_delay)
+        with self.lock:
+            self.requests["submitJob"] += 1
+            if params.get("token") not in self.tokens:
+                return {"error": {"code": 498, "message": "Invalid token"}}
+
+            jobid = "j" + uuid.uuid4().hex
+            self.jobs[jobid] = time.time() + self.job_duration
+
+            # The notification email arrives a little after the job has finished
+            url = f"{self.base_url}/gpresults/3DClipAndShip/{jobid}/export.zip"
+            timer = threading.Timer(self.job_duration + self.email_delay, self.mailbox.add,
+                                    [create_notification(params.get("navn", ""), jobid, url)])
+            timer.daemon = True
+            timer.start()
+            self.timers.append(timer)
+
+        return {"jobId": jobid, "jobStatus": "esriJobSubmitted"}
+
+    def job_status(self, jobid, params):
+        time.sleep(self.status_delay)
+        with self.lock:
+            self.requests["status"] += 1
+            if params.get("token") not in self.tokens or jobid not in self.jobs:
+                return {"error": {"code": 400, "message": "Invalid job"}}
+            done = time.time() >= self.jobs[jobid]
+
+        return {"jobId": jobid, "jobStatus": "esriJobSucceeded" if done else "esriJobExecuting"}
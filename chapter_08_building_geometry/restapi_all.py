@@ -1,7 +1,88 @@
-from restapi_buildings import check_job_status, get_download_url, get_token, submit_job, upload_to_nucleus, download_files, decrypt_passwords, embed_materials, cache_files
-from restapi_transform import add_to_scene, import_transformation_matrix, transform_mesh
+import asyncio
+from getpass import getpass
+import time
+
+from area_tiling import download_tile, restore_tile, split_polygon, submit_tiles
+from export_cache import export_key
+from imap_watcher import DownloadLinkWatcher
+from job_manager import run_jobs
+from restapi_buildings import GeodataClient, upload_to_nucleus, decrypt_passwords, cache_files
+from restapi_transform import add_to_scene, transform_mesh
+from obj_to_usd import convert_objs
 from omniverse_utils import start_omniverse, open_stage
 
+def run_pipeline(client, coords, epost, open_watcher, path_cache, path_nucleus, tile_size=500,
+                 min_interval=1.0, initial_delay=5, max_delay=120, poll_interval=60, on_stage=None):
+    # Export, download, convert and sync the buildings of an area, up to the scene import.
+    # on_stage is called with the name and duration of every stage (see benchmark_pipeline).
+    # Returns whether all stages succeeded
+    stage_start = [time.perf_counter()]
+
+    def finish_stage(name):
+        time_now = time.perf_counter()
+        if on_stage:
+            on_stage(name, time_now - stage_start[0])
+        stage_start[0] = time_now
+
+    # The client reuses its connections, and a cached token from earlier runs
+    if not client.get_token():
+        return False
+    finish_stage("token")
+
+    # Split the area into tiles, so that every job stays within the server's size limits
+    tiles = split_polygon(coords, tile_size=tile_size)
+    print(f"Area split into {len(tiles)} tiles\n")
+
+    projection = "EPSG:25833 (UTM 33N)"
+    content = ["3D Bygg med taktekstur"]
+    formats = ["Wavefront OBJ"]
+
+    # Tiles exported by earlier runs are taken from the local cache, only the rest is requested.
+    # Every tile is extracted straight into the merged tree, skipping files that are up to date
+    keys = {tile_id: export_key(tile_coords, projection, content, formats) for tile_id, tile_coords in tiles}
+    cached = [tile_id for tile_id, _ in tiles if restore_tile(keys[tile_id], tile_id)]
+    tiles = [(tile_id, tile_coords) for tile_id, tile_coords in tiles if tile_id not in cached]
+    print(f"{len(cached)} tiles found in the export cache, {len(tiles)} to export\n")
+    finish_stage("cache")
+
+    jobids = asyncio.run(submit_tiles(tiles, projection, content, formats, epost, client, min_interval=min_interval))
+    if not all(jobids.values()):
+        return False
+    tile_ids = {jobid: tile_id for tile_id, jobid in jobids.items()}
+    finish_stage("submit")
+
+    # One watcher matches the download link emails to all submitted jobs
+    if tile_ids:
+        watcher = open_watcher()
+        for jobid, tile_id in tile_ids.items():
+            watcher.expect(jobid, f"script_test_2_{tile_id}")
+
+        def download_result(jobid, succeeded):
+            # Next pipeline stage, started as soon as the job has finished
+            if not succeeded:
+                return False
+            url = watcher.wait_for_url(jobid, f"script_test_2_{tile_ids[jobid]}", poll_interval=poll_interval)
+            download_tile(url, keys[tile_ids[jobid]], tile_ids[jobid], client.session)
+            return True
+
+        # Downloads of finished tiles run in parallel while the remaining jobs are polled
+        try:
+            results = asyncio.run(run_jobs(list(tile_ids), client, download_result, initial_delay, max_delay))
+        finally:
+            watcher.close()
+        if not all(results.values()):
+            return False
+    finish_stage("jobs")
+
+    # Convert the buildings to binary USD files, which load much faster than OBJ files
+    convert_objs("buildings/wavefrontobj")
+    finish_stage("convert")
+
+    cache_files(path_cache)
+    upload_to_nucleus(path_nucleus)
+    finish_stage("sync")
+    return True
+
 def main():
     epost = "emailaddr@emailprovider.extension"
     username = "username"
@@ -16,29 +97,24 @@ def main():
 
     server_password, email_password = decrypt_passwords()
 
-    token = get_token(username, server_password)
-    if not token:
-        return
+    client = GeodataClient(username, server_password)
 
-    jobid = submit_job(coords, "EPSG:25833 (UTM 33N)", ["3D Bygg med taktekstur"], ["Wavefront OBJ"], epost, token)
-    if not jobid:
-        return
-    
-    if not check_job_status(jobid, token):
+    # The watcher is only logged in if there are jobs to wait for
+    def open_watcher():
+        return DownloadLinkWatcher(epost, email_password or getpass("Email account password: "))
+
+    if not run_pipeline(client, coords, epost, open_watcher,
+                        "AppData/Local/ov/cache/client/omniverse/localhost/Users/test/assets", "O:/assets"):
         return
-    
-    url = get_download_url(epost, email_password)
-    download_files(url)
-    cache_files("AppData/Local/ov/cache/client/omniverse/localhost/Users/test/assets")
-    upload_to_nucleus("O:/assets")
 
     start_omniverse(True)
     stage_url = "gloshaugen.usd"
-    stage = open_stage(stage_url)
+    # The buildings are only authored, so none of them need to be loaded
+    stage = open_stage(stage_url, load_payloads=False)
     add_to_scene(stage)
 
-    matrix = import_transformation_matrix()
-    transform_mesh(stage, matrix)
+    # Each export is placed with the transformation matrix it came with
+    transform_mesh(stage)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,15 +1,24 @@
-import imaplib
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 from getpass import getpass
-import email
+import json
 import os
-import re
-import shutil
+import threading
 import time
-from urllib.request import urlretrieve 
-import zipfile
 
 from cryptography.fernet import Fernet, InvalidToken
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from archive_download import download_archive, extract_archive
+from file_utils import atomic_path
+from file_sync import sync_tree
+from imap_watcher import DownloadLinkWatcher
+from obj_io import read_obj, write_obj
+
+# Base URL of the Geodata Online ArcGIS services
+GEODATA_URL = "https://services.geodataonline.no/arcgis"
 
 def decrypt_passwords():
     # Checking for file existence
@@ -41,8 +50,9 @@ def decrypt_passwords():
     print("Password decryption succeeded!\n")
     return server_password, email_password
 
-def get_token(username, password):
-    token_url = f"https://services.geodataonline.no/arcgis/tokens/generateToken"
+def request_token(username, password, session=None, url=GEODATA_URL):
+    token_url = f"{url}/tokens/generateToken"
+    http = session or requests
 
     # Need password to log in to account
     password = password if password else getpass("Geodata Online password:")
@@ -56,19 +66,26 @@ def get_token(username, password):
     }
 
     print("Requesting token...")
-    response = requests.post(token_url, data=params).json()
+    response = http.post(token_url, data=params).json()
 
     if "token" not in response:
         print("Token request unsuccessful! Terminating")
         return None
 
+    return response
+
+def get_token(username, password, session=None, url=GEODATA_URL):
+    response = request_token(username, password, session, url)
+    if not response:
+        return None
+
     token = response["token"]
     print(f"Token: {token}\n")
 
     return token
 
-def submit_job(coords, projection, content, formats, epost, token):
-    api_url = "https://services.geodataonline.no/arcgis/rest/services/Geoeksport/3DClipAndShip/GPServer/ClipAndShip3D/submitJob"
+def submit_job(coords, projection, content, formats, epost, token, navn="script_test_2", session=None, url=GEODATA_URL):
+    api_url = f"{url}/rest/services/Geoeksport/3DClipAndShip/GPServer/ClipAndShip3D/submitJob"
 
     # Valid content types
     possible_content = [
@@ -118,9 +135,6 @@ def submit_job(coords, projection, content, formats, epost, token):
     # String defining the geometry of the area to be exported
     omrade = f'{{"geometryType":"esriGeometryPolygon","features":[{{"geometry":{{"rings":[{coords}],"spatialReference":{{"wkid":{epsg},"latestWkid":{epsg}}}}}}}],"sr":{{"wkid":{epsg},"latestWkid":{epsg}}}}}'
 
-    # The name of the job
-    navn = "script_test_2"
-
     # All data to be sent to the server
     data = {
         "omrade": omrade,
@@ -137,7 +151,7 @@ def submit_job(coords, projection, content, formats, epost, token):
     }
 
     print("Submitting job to Geodata servers...")
-    response = requests.post(api_url, data=data).json()
+    response = (session or requests).post(api_url, data=data).json()
 
     if "jobId" not in response:
         print("Job submission unsuccessful! Terminating")
@@ -148,29 +162,127 @@ def submit_job(coords, projection, content, formats, epost, token):
 
     return jobid
 
-def check_job_status(jobid, token):
-    api_url = f"https://services.geodataonline.no/arcgis/rest/services/Geoeksport/3DClipAndShip/GPServer/ClipAndShip3D/jobs/{jobid}"
+def create_session(retries=3, pool_size=16):
+    # Session that keeps connections (and TLS handshakes) alive between requests,
+    # and retries requests that fail because of connection or server errors
+    session = requests.Session()
+    retry = Retry(total=retries, backoff_factor=0.5, status_forcelist=[500, 502, 503, 504])
+    adapter = HTTPAdapter(max_retries=retry, pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+    return session
+
+class GeodataClient:
+    # Client for the Geodata Online REST services. Reuses pooled connections, and
+    # caches the token on disk (encrypted with the server key) until it expires.
+    # The services can be replaced by others at a different URL (see mock_services)
+
+    def __init__(self, username, password=None, path_token="token.txt", path_key="server.key", url=GEODATA_URL):
+        self.username = username
+        self.password = password
+        self.url = url
+        self.path_token = path_token
+        self.session = create_session()
+        self.token = None
+        self.expires = 0
+        self.token_lock = threading.Lock()
+
+        # Without the key, the token is only cached for the lifetime of the client
+        self.fernet = None
+        if os.path.exists(path_key):
+            with open(path_key, "rb") as keyfile:
+                self.fernet = Fernet(keyfile.read())
+
+    def load_token(self):
+        if not self.fernet or not os.path.exists(self.path_token):
+            return
+
+        try:
+            with open(self.path_token, "rb") as tokenfile:
+                cached = json.loads(self.fernet.decrypt(tokenfile.read()))
+            self.token, self.expires = cached["token"], cached["expires"]
+        except (InvalidToken, ValueError, KeyError):
+            print("Cached token could not be read")
+
+    def save_token(self):
+        if not self.fernet:
+            return
+
+        # Write to a temporary file first, so the cache is never left half written
+        with atomic_path(self.path_token) as path_tmp, open(path_tmp, "wb") as tokenfile:
+            tokenfile.write(self.fernet.encrypt(json.dumps({"token": self.token, "expires": self.expires}).encode()))
+
+    def token_valid(self, margin=300):
+        # Expiry is given in milliseconds since the epoch. Renew a few minutes early
+        return self.token is not None and self.expires / 1000 - margin > time.time()
+
+    def get_token(self):
+        # The client is shared by executor threads (submit_tiles, run_jobs), so only one
+        # of them checks, renews and saves the token at a time
+        with self.token_lock:
+            if not self.token_valid():
+                self.load_token()
+
+            if self.token_valid():
+                print("Using cached token\n")
+                return self.token
+
+            response = request_token(self.username, self.password, self.session, self.url)
+            if not response:
+                return None
+
+            # Fall back to the requested expiration (24 hours) if the server does not report it
+            self.token = response["token"]
+            self.expires = response.get("expires", (time.time() + 1440 * 60) * 1000)
+            self.save_token()
+            print("Token received and cached\n")
+
+            return self.token
+
+    def submit_job(self, coords, projection, content, formats, epost, navn="script_test_2"):
+        return submit_job(coords, projection, content, formats, epost, self.get_token(), navn, self.session, self.url)
+
+    def get_job_status(self, jobid):
+        return get_job_status(jobid, self.get_token(), self.session, self.url)
+
+    def check_job_status(self, jobid):
+        return check_job_status(jobid, self.get_token(), self.session, self.url)
+
+# Statuses after which a ClipAndShip job does not change anymore
+STATII = {"esriJobSucceeded", "esriJobFailed", "esriJobCancelled", "esriJobTimedOut", "esriJobDeleted"}
+
+def backoff_delays(initial=5, factor=1.5, maximum=120):
+    # Adaptive polling schedule: poll often at first, then less and less frequently
+    delay = initial
+    while True:
+        yield delay
+        delay = min(delay * factor, maximum)
+
+def get_job_status(jobid, token, session=None, url=GEODATA_URL):
+    api_url = f"{url}/rest/services/Geoeksport/3DClipAndShip/GPServer/ClipAndShip3D/jobs/{jobid}"
 
     params = {
         "f": "pjson", # Result should be JSON formatted
         "token": token # We need a valid token to access this API endpoint
     }
 
+    response = (session or requests).get(api_url, params=params).json()
+    return response.get("jobStatus", "")
+
+def check_job_status(jobid, token, session=None, url=GEODATA_URL):
     status = ""
-    statii = ["esriJobSucceeded", "esriJobFailed"]
-    first = True
+    delays = backoff_delays()
 
     print("Checking job status...")
 
-    while status not in statii:
-        if not first:
-            time.sleep(600)
-        first = False
-
-        response = requests.get(api_url, params=params).json()
-        if "jobStatus" in response:
-            status = response["jobStatus"]
+    while True:
+        status = get_job_status(jobid, token, session, url)
+        if status:
             print(f"Job status: {status}")
+        if status in STATII:
+            break
+        time.sleep(next(delays))
 
     if status == "esriJobSucceeded":
         print("Job has finished!\n")
@@ -179,121 +291,94 @@ def check_job_status(jobid, token):
         print("Job has failed!")
         return False
 
-def get_download_url(epost, password):
+def get_download_url(epost, password, jobid=None):
     # We assume we're using a gmail account
-    imap = imaplib.IMAP4_SSL("imap.gmail.com")
-
     password = password if password else getpass("Email account password: ")
-    print("Logging into email account...")
-    imap.login(epost, password)
-    print("Logged in.")
+    watcher = DownloadLinkWatcher(epost, password)
 
-    messages = imap.select("INBOX")[1]
-    message_count = messages[0]
+    try:
+        return watcher.wait_for_url(jobid)
+    finally:
+        watcher.close()
 
-    def wait():
-        # Mini function for waiting for email
-        print("Email not yet received. Waiting...")
-        time.sleep(60)
+def download_files(url, path="buildings", session=None):
+    path_zip = f"{path}.zip"
+    os.makedirs(os.path.dirname(os.path.abspath(path_zip)), exist_ok=True)
 
-    while True:
-        # Only look at the latest email in the inbox
-        print("Fetching latest email...")
-        msg_raw = imap.fetch(message_count, "(RFC822)")
-        msg = email.message_from_bytes(msg_raw[1][0][1])
-
-        # Ignore all mails not from the appropriate sender
-        if msg["From"] != "Geodataonline@geodata.no":
-            wait()
-            continue
-
-        # If the mail has the appropriate origin:
-        # Try to find the download URL
-        text = msg.get_payload(decode=True).decode()
-        url = re.search(r"(?P<url>https://geodata-gdonline-gdo-processing-geoprocessing\.s3\.amazonaws\.com/gpresults/3DClipAndShip/.*)", text).group("url")
-
-        # If no download URL was found, this probably means that the latest email
-        # was the job start confirmation. Wait a bit more.
-        if not url:
-            wait()
-            continue
-        
-        print("Email received!")
-        return url
-
-def download_files(url):
-    # TODO: Remove already existing files on Nucleus
     print("Downloading files...")
-    urlretrieve(url, "buildings.zip")
+    download_archive(url, path_zip, session)
     print("Files downloaded!")
 
     print("Unzipping...")
-    with zipfile.ZipFile("buildings.zip", "r") as zip:
-        zip.extractall("buildings")
+    extract_archive(path_zip, path)
     print("Files unzipped!\n")
 
     # We don't need the zip file afterwards. Delete
-    os.remove("buildings.zip")
+    os.remove(path_zip)
     return
 
-def embed_materials():
+@lru_cache(maxsize=None)
+def parse_mtl(path_mtl, mtime):
+    # Parse a material file into a dict of material name -> lines of its definition.
+    # Cached per process, keyed on the modification time so edited files are re-read
+    materials = {}
+    name = None
+    with open(path_mtl) as mtlfile:
+        for line in mtlfile:
+            line = line.strip()
+            if line.startswith("newmtl "):
+                name = line.split()[1]
+                materials[name] = [line]
+            elif name is not None and line:
+                materials[name].append(line)
+
+    return materials
+
+def embed_materials_file(obj_path):
+    # Parse the .obj file. Files without a reference to a .mtl file are already embedded
+    obj = read_obj(obj_path)
+    if not obj["mtllibs"]:
+        return False
+
+    materials = {}
+    for mtllib in obj["mtllibs"]:
+        path_mtl = os.path.join(os.path.dirname(obj_path), mtllib)
+        materials.update(parse_mtl(path_mtl, os.path.getmtime(path_mtl)))
+
+    # Get the materials referenced in the .obj file, each once and in order of first use
+    materials_in_file = dict.fromkeys(name for name, _, _ in obj["materials"])
+
+    # Write the file with the material definitions in place of the reference to the .mtl file
+    obj["mtl_lines"] = [line for m in materials_in_file if m in materials for line in materials[m]]
+    obj["mtllibs"] = []
+    write_obj(obj_path, obj)
+    return True
+
+def embed_materials(path="buildings/wavefrontobj", workers=None):
     # This is a function to embed material info in each obj file.
     # This is due to a bug in Omniverse/USD where adding a reference
     # to obj files will only add the obj files (not mtl files) in cache.
     # This will result in the mesh not rendering at all.
 
-    # Getting a list of all .obj files
-    files = os.listdir("buildings/wavefrontobj")
-    obj_files = filter(lambda f: f.endswith(".obj"), files)
-
-    for obj_file in obj_files:
-        # Read the content of the .obj file
-        obj_path = f"buildings/wavefrontobj/{obj_file}"
-        with open(obj_path) as f:
-            content = f.readlines()
-        
-        # Find the name of the .mtl file
-        for line in content:
-            if line.startswith("mtllib "):
-                mtllib = line.split()[1]
-                break
-        
-        # Read the materials file
-        with open(f"buildings/wavefrontobj/{mtllib}") as mtlfile:
-            materials = mtlfile.read()
-        
-        # Split the contents of the material file to a list of materials
-        materials = "\n".join(materials.split("\n")[1:])
-        materials = materials.split("\n\n")
-
-        # Get a list of all materials referenced in the .obj file
-        materials_in_file = [line.split()[1] for line in content if line.startswith("usemtl ")]
-
-        embedded_materials = []
-
-        # Get the material info from the .mtl file for all materials referenced in the .obj file
-        for m_in_f in materials_in_file:
-            for m in materials:
-                if m.startswith(f"newmtl {m_in_f}"):
-                    embedded_materials.append(m)
-                    break
-        
-        # Transform material list to string
-        embedded_materials = "\n\n".join(embedded_materials)
-        
-        # Remove the reference to the .mtl file and embed the material definitions themselves
-        content_new = "".join(content).replace(f"mtllib {mtllib}", embedded_materials)
-        
-        # Write the updates to file
-        with open(obj_path, "w") as f:
-            f.write(content_new)
+    # Getting a list of all .obj files, including those of merged area tiles
+    obj_paths = [os.path.join(root, f) for root, _, files in os.walk(path)
+                 for f in files if f.endswith(".obj")]
+
+    # Embed the materials of many files at once, spread over all cores
+    print(f"Embedding materials in {len(obj_paths)} files...")
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        embedded = sum(executor.map(embed_materials_file, obj_paths, chunksize=16))
+
+    print(f"Embedded materials in {embedded} files, {len(obj_paths) - embedded} already embedded")
 
 def cache_files(path_to_cache):
+    # Only files that changed since the last run are copied
     print("Adding files to local cache...")
-    shutil.copytree("buildings", path_to_cache)
+    sync_tree("buildings", path_to_cache)
     print("Files cached!")
 
 def upload_to_nucleus(path):
+    # The local export is kept, so that the next upload only copies what changed
     print("Uploading files to Omniverse Nucleus...")
-    shutil.move(os.path.abspath("buildings"), path)
+    sync_tree("buildings", os.path.join(path, "buildings"))
     print("Files uploaded!")
@@ -1,27 +1,85 @@
+import os
+
 import numpy as np
-from pxr import UsdGeom, Gf
+from pxr import Gf, Sdf, Tf, UsdGeom
 
+from georeferencing import to_scene
+from obj_to_usd import get_usd_path
 from omniverse_utils import save_stage
 
-def get_obj_file_list():
-    # For now, only process one object at a time
-    return ["uvmapping.obj"]
+def get_obj_file_list(path="buildings/wavefrontobj"):
+    # All exported .obj files, including those of merged area tiles, relative to the export folder
+    return sorted(os.path.relpath(os.path.join(root, f), path).replace(os.sep, "/")
+                  for root, _, files in os.walk(path) for f in files if f.endswith(".obj"))
 
-def add_to_scene(stage):
-    print("Adding objects to scene...")
-    obj_files = get_obj_file_list()
+def get_prim_path(obj_file):
+    # One prim per file, named after its path within the export, e.g. /Root/tile_0_0_uvmapping_uvmapping
+    return f"/Root/{Tf.MakeValidIdentifier(os.path.splitext(obj_file)[0].replace('/', '_'))}"
+
+def get_scene_files(stage, asset_path="./assets/buildings/wavefrontobj"):
+    # Prim path of every building in the scene by its payload, i.e. the converted file
+    # relative to the export folder
+    root = stage.GetPrimAtPath("/Root")
+    scene_files = {}
+    for prim in (root.GetAllChildren() if root else []):
+        for spec in prim.GetPrimStack():
+            for payload in spec.payloadList.GetAddedOrExplicitItems():
+                if payload.assetPath.startswith(f"{asset_path}/"):
+                    scene_files[payload.assetPath[len(asset_path) + 1:]] = prim.GetPath()
+    return scene_files
 
+def get_prim_paths(stage, obj_files, asset_path="./assets/buildings/wavefrontobj"):
+    # Prim path of every OBJ file. Files in the scene already keep their prim. New files get
+    # the path from get_prim_path, with a number added if that is taken, as different files
+    # can give the same name (e.g. a_b/c.obj and a/b_c.obj both give /Root/a_b_c)
+    scene_files = get_scene_files(stage, asset_path)
+    root = stage.GetPrimAtPath("/Root")
+    taken = {prim.GetPath() for prim in root.GetAllChildren()} if root else set()
+
+    prim_paths = {}
     for obj_file in obj_files:
-        filename = obj_file.split(".")[0]
-        UsdGeom.Xform.Define(stage, f"/Root/{filename}")
-        root = stage.GetPrimAtPath(f"/Root/{filename}")
-        root.GetReferences().AddReference(f"./assets/uvmapping/{obj_file}")
+        prim_path = scene_files.get(get_usd_path(obj_file))
+        if prim_path is None:
+            prim_path = base = Sdf.Path(get_prim_path(obj_file))
+            number = 1
+            while prim_path in taken:
+                prim_path = Sdf.Path(f"{base}_{number}")
+                number += 1
+        taken.add(prim_path)
+        prim_paths[obj_file] = prim_path
+    return prim_paths
+
+def add_to_scene(stage, path="buildings/wavefrontobj", asset_path="./assets/buildings/wavefrontobj"):
+    print("Adding objects to scene...")
+    obj_files = get_obj_file_list(path)
+
+    if not stage.GetPrimAtPath("/Root"):
+        UsdGeom.Xform.Define(stage, "/Root")
+
+    # Buildings whose OBJ file is gone from the export are removed from the scene
+    usd_files = {get_usd_path(obj_file) for obj_file in obj_files}
+    removed = [prim_path for usd_file, prim_path in get_scene_files(stage, asset_path).items() if usd_file not in usd_files]
+    for prim_path in removed:
+        stage.RemovePrim(prim_path)
+
+    # Each building is added as a payload, so that it is only loaded when needed.
+    # The payloads are the binary USD files converted from the OBJ files (see convert_objs).
+    # All prims are authored directly in the layer in one batch, and the stage is saved once
+    prim_paths = get_prim_paths(stage, obj_files, asset_path)
+    layer = stage.GetEditTarget().GetLayer()
+    with Sdf.ChangeBlock():
+        for obj_file in obj_files:
+            spec = Sdf.CreatePrimInLayer(layer, prim_paths[obj_file])
+            spec.specifier = Sdf.SpecifierDef
+            spec.typeName = "Xform"
+            spec.payloadList.prependedItems = [Sdf.Payload(f"{asset_path}/{get_usd_path(obj_file)}")]
     save_stage(stage)
+    print(f"Added {len(obj_files)} objects, removed {len(removed)}")
 
-def import_transformation_matrix():
+def import_transformation_matrix(path_transform="O:/assets/uvmapping/global.fwt"):
     print("Loading transformation matrix...")
     # Read transformation matrix from file
-    with open(f"O:/assets/uvmapping/global.fwt") as file_transform:
+    with open(path_transform) as file_transform:
         transform = file_transform.readlines()
     
     # Parse transformation matrix
@@ -29,32 +87,36 @@ def import_transformation_matrix():
     transform = np.array(transform).T
 
     # Apply offsets
-    transform[3][0] -= 270630.659
-    transform[3][1] = -(transform[3][1] - 7040355.576)
-    transform[3][2] -= 46.670
-    transform[3][1], transform[3][2] = transform[3][2], transform[3][1]
+    transform[3][:3] = to_scene(transform[3][:3])
 
     return transform
 
-def transform_mesh(stage, matrix_transform):
+def transform_mesh(stage, matrix_transform=None, path="buildings/wavefrontobj", asset_path="./assets/buildings/wavefrontobj"):
     print("Transforming objects...")
-    matrix_usd = Gf.Matrix4d(matrix_transform)
-
     # Rotate mesh 90 degrees to account for difference in up axis
     matrix_rotation = Gf.Matrix4d()
     matrix_rotation.SetRotate(Gf.Rotation(Gf.Vec3d(1, 0, 0), -90))
-    matrix_usd = matrix_rotation * matrix_usd
 
-    obj_files = get_obj_file_list()
+    obj_files = get_obj_file_list(path)
+    prim_paths = get_prim_paths(stage, obj_files, asset_path)
 
-    # Add transformation matrix attribute
+    # Every export (e.g. every area tile) comes with its own transformation matrix,
+    # unless one matrix is given for all of them
+    matrices = {}
     for obj_file in obj_files:
-        filename = obj_file.split(".")[0]
-        prim = stage.GetPrimAtPath(f"/Root/{filename}")
-        xform = UsdGeom.Xformable(prim)
-        transform = xform.MakeMatrixXform()
+        directory = os.path.dirname(os.path.join(path, obj_file))
+        if directory not in matrices:
+            matrix = matrix_transform if matrix_transform is not None else import_transformation_matrix(os.path.join(directory, "global.fwt"))
+            matrices[directory] = matrix_rotation * Gf.Matrix4d(matrix)
+
+    # Add transformation matrix attribute, for all prims in one batch
+    with Sdf.ChangeBlock():
+        for obj_file in obj_files:
+            prim = stage.GetPrimAtPath(prim_paths[obj_file])
+            xform = UsdGeom.Xformable(prim)
+            transform = xform.MakeMatrixXform()
 
-        transform.Set(matrix_usd)
+            transform.Set(matrices[os.path.dirname(os.path.join(path, obj_file))])
 
     save_stage(stage)
     print("Done!")
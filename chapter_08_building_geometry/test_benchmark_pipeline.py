@@ -0,0 +1,31 @@
+import os
+
+import pytest
+
+# The pipeline converts to USD and imports Omniverse, which are only there in its environment
+pytest.importorskip("pxr")
+pytest.importorskip("omni.client")
+
+import restapi_buildings
+from benchmark_pipeline import STAGES, run_benchmarks, square
+from mock_services import MockServices
+
+def test_pipeline():
+    services = MockServices(token_delay=0, submit_delay=0, status_delay=0, job_duration=0.5, email_delay=0.1,
+                            download_delay=0, buildings=5)
+    path_cwd = os.getcwd()
+    try:
+        # Two tiles, exported in the first run and taken from the export cache in the second
+        coords = square((271000.0, 7040250.0), 400)
+        results = run_benchmarks(services, coords, 500, 0.1, runs=2)
+    finally:
+        services.close()
+
+    # Every run has its own client, which has no key to keep the token between runs
+    assert [list(timings) for timings in results] == [STAGES, STAGES]
+    assert services.requests["generateToken"] == 2
+    assert services.requests["submitJob"] == 2
+
+    # Nothing is left changed for the rest of the process
+    assert os.getcwd() == path_cwd
+    assert restapi_buildings.GEODATA_URL == "https://services.geodataonline.no/arcgis"
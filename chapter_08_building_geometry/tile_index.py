@@ -0,0 +1,111 @@
+import argparse
+import math
+
+import numpy as np
+from pxr import Gf, Usd, UsdGeom
+
+from georeferencing import from_scene
+from omniverse_utils import start_omniverse, open_stage
+
+class TileIndex:
+    # Groups the building prims of a stage by UTM grid cell, and loads only the payloads
+    # of the cells around a position. Prims are placed by the world-space bounds of their
+    # meshes, as every building of an export shares the transformation of global.fwt.
+    # A building that crosses cell borders is in every cell it overlaps
+
+    def __init__(self, stage, root="/Root", tile_size=500):
+        self.stage = stage
+        self.tile_size = tile_size
+        self.tiles = {}
+        self.loaded = set()
+        self.bbox_cache = UsdGeom.BBoxCache(Usd.TimeCode.Default(), [UsdGeom.Tokens.default_])
+
+        # Building prims are the children of the root with payloads, whether loaded or not
+        prims = [prim for prim in stage.GetPrimAtPath(root).GetAllChildren() if prim.HasAuthoredPayloads()]
+        for prim in prims:
+            bounds = self.get_bounds(prim)
+            if bounds is None:
+                print(f"No bounds for {prim.GetPath()}, it is not indexed")
+                continue
+            for cell in self.get_cells_in(*bounds):
+                self.tiles.setdefault(cell, []).append(prim.GetPath())
+
+        # Payloads that are loaded already, e.g. when the stage was opened with all payloads
+        for cell, paths in self.tiles.items():
+            if any(stage.GetPrimAtPath(path).IsLoaded() for path in paths):
+                self.loaded.add(cell)
+
+        print(f"Indexed {len(prims)} buildings in {len(self.tiles)} tiles")
+
+    def get_bounds(self, prim):
+        # World-space bounds (minimum and maximum scene position) of a building.
+        # An unloaded payload is opened on its own to read the extent of its mesh,
+        # which is then moved by the transformation of the prim
+        if prim.IsLoaded():
+            box = self.bbox_cache.ComputeWorldBound(prim)
+        else:
+            box = None
+            for spec in prim.GetPrimStack():
+                for payload in spec.payloadList.GetAddedOrExplicitItems():
+                    payload_stage = Usd.Stage.Open(spec.layer.ComputeAbsolutePath(payload.assetPath))
+                    payload_prim = payload_stage.GetPrimAtPath(payload.primPath) if payload.primPath else payload_stage.GetDefaultPrim()
+                    payload_box = UsdGeom.BBoxCache(Usd.TimeCode.Default(), [UsdGeom.Tokens.default_]).ComputeUntransformedBound(payload_prim)
+                    box = payload_box if box is None else Gf.BBox3d.Combine(box, payload_box)
+            if box is None:
+                return None
+            box.Transform(UsdGeom.Xformable(prim).ComputeLocalToWorldTransform(Usd.TimeCode.Default()))
+
+        bounds = box.ComputeAlignedRange()
+        if bounds.IsEmpty():
+            return None
+        return np.array(bounds.GetMin()), np.array(bounds.GetMax())
+
+    def get_cells_in(self, minimum, maximum):
+        # Grid cells (easting, northing) overlapped by a box between two scene positions
+        utm = from_scene([minimum, maximum])
+        low = np.floor(utm[:, :2].min(axis=0) / self.tile_size).astype(np.int64)
+        high = np.floor(utm[:, :2].max(axis=0) / self.tile_size).astype(np.int64)
+        return [(i, j) for i in range(low[0], high[0] + 1) for j in range(low[1], high[1] + 1)]
+
+    def get_cells_around(self, position, radius=500):
+        # All cells within a square of the given radius (in meters) around a scene position
+        easting, northing, _ = from_scene(position)
+        return {(i, j) for i in range(math.floor((easting - radius) / self.tile_size), math.floor((easting + radius) / self.tile_size) + 1)
+                for j in range(math.floor((northing - radius) / self.tile_size), math.floor((northing + radius) / self.tile_size) + 1)
+                if (i, j) in self.tiles}
+
+    def load(self, cells):
+        # Load and unload payloads, so that only the given cells are loaded. Buildings
+        # in a cell that stays loaded are kept, even if another of their cells is unloaded
+        cells = set(cells)
+        keep = {path for cell in cells for path in self.tiles[cell]}
+        loaded = {path for cell in self.loaded for path in self.tiles[cell]}
+        to_load = sorted(keep - loaded)
+        to_unload = sorted(loaded - keep)
+        if to_load or to_unload:
+            self.stage.LoadAndUnload(to_load, to_unload, Usd.LoadWithDescendants)
+        self.loaded = cells
+        return len(to_load), len(to_unload)
+
+    def update(self, position, radius=500):
+        # Load the neighbourhood around a scene position (e.g. the vehicle), unload the rest.
+        # Nothing is done until the neighbourhood changes
+        return self.load(self.get_cells_around(position, radius))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("x", type=float)
+    parser.add_argument("y", type=float)
+    parser.add_argument("z", type=float)
+    parser.add_argument("--radius", type=float, default=500, help="Distance in meters to load buildings within")
+    parser.add_argument("--tile-size", type=float, default=500, help="Tile size in meters")
+    args = parser.parse_args()
+
+    start_omniverse(True)
+    stage = open_stage("gloshaugen.usd", load_payloads=False)
+
+    # Which payloads are loaded is state of this stage only (its load rules), and is not
+    # saved to the file. This shows what would be loaded, others opening the stage are not affected
+    tile_index = TileIndex(stage, tile_size=args.tile_size)
+    loaded, unloaded = tile_index.update((args.x, args.y, args.z), args.radius)
+    print(f"Loaded {loaded} buildings, unloaded {unloaded} (in this session only, nothing is saved)")
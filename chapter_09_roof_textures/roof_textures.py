@@ -1,6 +1,8 @@
 import numpy as np
 from osgeo import gdal
 
+import obj_io
+
 def transform_vertices(path, vertices):
     # Open transform file
     with open(path) as file_transform:
@@ -11,13 +13,13 @@ def transform_vertices(path, vertices):
     transform = np.array(transform).T
 
     # Transform vertices!
-    vertices_transformed = ([((*v, 1.0) @ transform)[:2] for v in vertices])
+    vertices_transformed = np.column_stack((vertices, np.ones(len(vertices)))) @ transform
     
-    return vertices_transformed
+    return vertices_transformed[:, :2]
 
 def compute_bounding_box(all_coords):
-    x, y = zip(*[c[1] for c in all_coords])
-    bounding_box = (min(x), max(y), max(x), min(y))
+    x, y = all_coords[:, 0], all_coords[:, 1]
+    bounding_box = (x.min(), y.max(), x.max(), y.min())
 
     return bounding_box
 
@@ -26,38 +28,13 @@ def transform_range(old_value, old_min, old_max, new_min, new_max):
     return new_value
 
 def read_obj(path_obj, path_transform):
-    # Read OBJ file
-    with open(path_obj) as objfile:
-        obj = objfile.read()
-    
-    lines = obj.split("\n")
-    
-    # Store relevant data
-    mtllines = []
-    vertices = []
-    uvs = []
-
-    # Store the line number of the first UV coordinate pair
-    uvs_start = None
-
-    # Collect line numbers and contents of material, vertex, and uv lines
-    for i, line in enumerate(lines):
-        if line.startswith("usemtl "):
-            mtllines.append((i, line))
-        elif line.startswith("v "):
-            vertices.append([float(c) for c in line.split()[1:]])
-        elif line.startswith("vt "):
-            uvs.append(float(c) for c in line.split()[1:])
-            if not uvs_start:
-                uvs_start = i
-
-    # Add a final, end-of-file dummy line to the materials list
-    mtllines.append((len(lines), ""))
+    # Read OBJ file into arrays of vertices, uvs, faces, and material ranges
+    obj = obj_io.read_obj(path_obj)
 
     # Transform all vertex coordinates based on global.fwt
-    vertices = transform_vertices(path_transform, vertices)
+    vertices = transform_vertices(path_transform, obj["points"])
 
-    return lines, mtllines, vertices, uvs, uvs_start
+    return obj, vertices
 
 def crop_texture(name, img, bounding_box):
     path_cropped = f"/wavefrontobj/materials_textures/{name}.png"
@@ -65,9 +42,8 @@ def crop_texture(name, img, bounding_box):
 
 def normalize_uvs(all_coords, bounding_box):
     minx, maxy, maxx, miny = bounding_box
-    normalized = list(map(lambda c: (c[0], (round(transform_range(c[1][0], minx, maxx, 0, 1), 6),
-                                            round(transform_range(c[1][1], miny, maxy, 0, 1), 6))),
-                            all_coords))
+    normalized = np.column_stack((np.round(transform_range(all_coords[:, 0], minx, maxx, 0, 1), 6),
+                                  np.round(transform_range(all_coords[:, 1], miny, maxy, 0, 1), 6)))
     
     return normalized
 
@@ -75,40 +51,20 @@ def update_uvs(path_obj, path_result, path_transform, path_img):
     # Open image texture
     img = gdal.Open(path_img)
 
-    lines, mtllines, vertices, uvs, uvs_start = read_obj(path_obj, path_transform)
+    obj, vertices = read_obj(path_obj, path_transform)
 
     # Loop through all materials
-    for i in range(len(mtllines) - 1):
-        # Find the name of the current material, as well as its start and end lines
-        name = mtllines[i][1].split()[1]
-        index_start = mtllines[i][0]
-        index_end = mtllines[i + 1][0]
-
-        # Extract vertex, uv, and normal data from material lines
-        lines_data = lines[index_start + 1:index_end]
-        lines_data = list(filter(lambda line: line.startswith("f "), lines_data))
-
-        # Store all UTM coordinates, to compute bounding box later
-        all_coords = []
-
-        # Loop through all faces having the current material
-        for line in lines_data:
-
-            # Find UV coordinates for each face, as well as its line number
-            data_face = [f.split("/") for f in line.split()[1:]]
-            data_uv = [(int(f[1]), uvs[int(f[1]) - 1]) for f in data_face if f[1]]
-
-            # Skip if there is no UV data
-            if not data_uv:
-                continue
-            
-            # Extract all UTM vertex coordinates belonging to the current face
-            data_vertex = [(int(f[1]), vertices[int(f[0]) - 1]) for f in data_face]
-            all_coords.extend(data_vertex)
-        
-        # Skip if there are no vertex coordinates!
-        if not all_coords:
+    for name, face_start, face_end in obj["materials"]:
+        # Skip if there is no UV data, or there are no faces!
+        if obj["vt_indices"] is None or face_start == face_end:
             continue
+
+        # Find the face corners having the current material
+        corners = slice(obj["offsets"][face_start], obj["offsets"][face_end])
+
+        # UV indices and UTM vertex coordinates of all corners
+        uv_indices = obj["vt_indices"][corners]
+        all_coords = vertices[obj["v_indices"][corners]]
         
         # Compute the bounding box (in UTM coordinates)
         bounding_box = compute_bounding_box(all_coords)
@@ -118,20 +74,10 @@ def update_uvs(path_obj, path_result, path_transform, path_img):
 
         # Normalize vertex coordinates to range [0, 1],
         # in practice converting them to UV coordinates
-        normalized = normalize_uvs(all_coords, bounding_box)
-        
-        # Update UV coordinates
-        for i, c in normalized:
-            uvs[i - 1] = c
-
-    # Update UV coordinate lines
-    uvs_str = [f"vt {u:.6f} {v:.6f}" for u, v in uvs]
-    lines[uvs_start:uvs_start + len(uvs)] = uvs_str
+        obj["uvs"][uv_indices] = normalize_uvs(all_coords, bounding_box)
 
     # Write result!
-    result = "\n".join(lines)
-    with open(path_result, "w") as objfile:
-        objfile.write(result)
+    obj_io.write_obj(path_result, obj)
 
 if __name__ == "__main__":
     # Define paths
@@ -5,7 +5,8 @@ import re
 import numpy as np
 from pxr import UsdGeom, Gf
 
-from chapter_7_position_data.connector_gnss import project_to_utm
+from georeferencing import wgs84_to_utm
+from obj_to_usd import convert_obj
 from omniverse_utils import start_omniverse, open_stage, save_stage
     
 def read_gnss(path):
@@ -135,10 +136,11 @@ def add_mesh_to_omniverse(path_file, path_usd, matrix):
     start_omniverse(True)
     stage = open_stage("omniverse://gloshaugen.usd")
 
-    # Add an OBJ reference
+    # Add a reference to the mesh, converted to a binary USD file unless it already is
+    path_reference, _ = convert_obj(path_file)
     UsdGeom.Xform.Define(stage, path_usd)
     prim = stage.GetPrimAtPath(path_usd)
-    prim.GetReferences().AddReference(path_file)
+    prim.GetReferences().AddReference(path_reference)
 
     # Set transformation matrix
     xform = UsdGeom.Xformable(prim)
@@ -160,17 +162,21 @@ if __name__ == "__main__":
     frames = [520, 14770, 15440]
 
     coords_from = []
-    coords_to = []
+    locations_car = []
 
-    # Get original WGS84 frames and translate to Omniverse coordinates
+    # Get original WGS84 frames
     for frame in frames:
         timestamp = get_timestamp_from_frame(path_timestamps, frame)
         location_car = get_location_from_timestamp(path_gnss, timestamp)
         location_camera = get_camera_location_from_frame(path_cameras, frame)
-        location_car_utm = project_to_utm(*location_car)
 
         coords_from.append(location_camera)
-        coords_to.append(location_car_utm)
+        locations_car.append(location_car)
+
+    # Project all car locations to UTM33N in one batch
+    lon, alt, lat = np.asarray(locations_car).T
+    easting, northing = wgs84_to_utm(lat, lon)
+    coords_to = np.column_stack((easting, alt, northing))
     
     # Compute transformation matrix
     matrix = generate_affine_matrix(coords_from, coords_to)
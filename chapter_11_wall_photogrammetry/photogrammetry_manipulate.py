@@ -5,8 +5,9 @@ import numpy as np
 import open3d
 from shapely.geometry import Point, Polygon
 
+from obj_io import read_obj, write_obj
 from omniverse_utils import start_omniverse, open_stage, save_stage
-from remove_verts import remove_vertices
+from remove_verts import filter_vertices
 
 def compute_face_normal(verts):
     # Use three vertices in computations
@@ -246,27 +247,18 @@ def update_points(mesh, flats, path_obj):
     # Create a new OBJ file from the contents of the entire photogrammetry mesh
     open3d.io.write_triangle_mesh(path_obj, mesh, write_vertex_normals=False)
 
-    # Read all lines from the newly created file
-    with open(path_obj) as file_obj:
-        lines = file_obj.readlines()
+    # Read the newly created file
+    obj = read_obj(path_obj)
     
     # Update material names in the new file with the names
     # from the old file
-    material_counter = 0
-    for i, line in enumerate(lines):
-        if line.startswith("usemtl "):
-            lines[i] = f"usemtl {materials[material_counter]}\n"
-            material_counter += 1
+    obj["materials"] = [(materials[i], start, end) for i, (_, start, end) in enumerate(obj["materials"])]
     
-    # Overwrite OBJ and MTL files
-    with open(path_obj, "w") as file_obj:
-        file_obj.writelines(lines)
+    # Remove unprocessed vertices, and overwrite OBJ and MTL files
+    write_obj(path_obj, filter_vertices(obj, indices_keep))
     
     with open(path_mtl, "w") as file_mtl:
         file_mtl.writelines(lines_materials)
-    
-    # Remove unprocessed vertices
-    remove_vertices(path_obj, indices_keep)
 
 if __name__ == "__main__":
     path_xform_building = "/Root/Elgesetergate_USD_Full_2/Bygninger/Shape_836/shape_1502"
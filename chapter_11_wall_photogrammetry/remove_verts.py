@@ -1,97 +1,69 @@
 import numpy as np
 
-def remove_vertices(path_obj, indices_keep):
-    print("Read from file")
-    with open(path_obj) as file_obj:
-        lines = file_obj.readlines()
-
-    # Store vertices, faces, and materials
-    verts = []
-    faces = []
-    mtls = []
+from obj_io import read_obj, write_obj
 
-    # Keep track of which line nummbers vertices and faces start with
-    v_start = f_start = False
-    v_start_index = f_start_index = 0
-
-    # Keep length of vertices, uv indices, and faces attributes
-    len_v = len_vt = 0
-
-    # Get start line numbers of attributes
-    print("Get initial positions")
-    for i, line in enumerate(lines):
-        if line.startswith("v "):
-            if not v_start:
-                v_start_index = i
-                v_start = True
-            verts.append(line)
-            len_v += 1
-        elif line.startswith("vt "):
-            len_vt += 1
-        elif line.startswith("f "):
-            faces.append(line)
-            if not f_start:
-                f_start_index = i
-                f_start = True
-        elif line.startswith("usemtl "):
-            mtls.append((i, line))
-    
-    verts = np.asarray(verts)
-    faces = np.asarray(faces)
-    
-    # First material is dupe for some reason? Remove
-    mtls.pop(0)
+def remap_elements(statements, verts_keep, indices_new):
+    # Point and line elements (p and l lines) reference vertices too.
+    # Elements with a removed vertex are dropped, like faces
+    result = []
+    kept = []
+    for face, line in statements:
+        keyword, _, corners = line.partition(" ")
+        if keyword in ("p", "l"):
+            corners = [corner.split("/") for corner in corners.split(" ")]
+            vertices = np.array([int(corner[0]) - 1 for corner in corners])
+            if (vertices < 0).any():
+                raise ValueError("Relative (negative) indices are not supported")
+            if not verts_keep[vertices].all():
+                kept.append(False)
+                continue
+            line = keyword + " " + " ".join("/".join([str(indices_new[v] + 1)] + corner[1:]) for v, corner in zip(vertices, corners))
+        result.append((face, line))
+        kept.append(True)
+    return result, kept
 
+def filter_vertices(obj, indices_keep):
     print("Generate keep mask for vertices")
-    verts_keep = np.asarray([False] * len(verts))
+    verts_keep = np.zeros(len(obj["points"]), dtype=bool)
     verts_keep[indices_keep] = True
-    print(verts_keep)
-
-    print("Generate final list of vertices to keep")
-    verts_final = verts[verts_keep]
 
+    # Only keep faces with all their vertices kept
     print("Find which faces to keep")
-    print("  faces_vertex_indices")
-    faces_vertex_indices = np.asarray([[int(c.split("/")[0]) for c in face.split()[1:]] for face in faces])
+    faces_keep = np.logical_and.reduceat(verts_keep[obj["v_indices"]], obj["offsets"][:-1]) if len(obj["counts"]) else np.zeros(0, dtype=bool)
+    corners_keep = np.repeat(faces_keep, obj["counts"])
 
-    # Generate keep mask for faces
-    print("  faces_keep")
-    faces_keep_mask = []
-    for face in faces_vertex_indices:
-        for vertex in face:
-            if not verts_keep[vertex - 1]:
-                faces_keep_mask.append(False)
-                break
-        else:
-            faces_keep_mask.append(True)
+    print("Update vertex indices")
+    indices_new = np.cumsum(verts_keep) - 1
+    obj["points"] = obj["points"][verts_keep]
+    if obj["point_extras"] is not None:
+        obj["point_extras"] = obj["point_extras"][verts_keep]
+    obj["v_indices"] = indices_new[obj["v_indices"][corners_keep]]
+    for key in ["vt_indices", "vn_indices"]:
+        if obj[key] is not None:
+            obj[key] = obj[key][corners_keep]
+    obj["counts"] = obj["counts"][faces_keep]
+    obj["offsets"] = np.concatenate(([0], np.cumsum(obj["counts"], dtype=np.int64)))
 
-    # Filter faces to keep
-    faces_new = faces_vertex_indices[faces_keep_mask]
-    faces_new_raw = faces[faces_keep_mask]
+    print("Calculate new face ranges for materials")
+    faces_before = np.concatenate(([0], np.cumsum(faces_keep)))
+    obj["materials"] = [(name, int(faces_before[start]), int(faces_before[end])) for name, start, end in obj["materials"]]
+    statements, statements_keep = remap_elements(obj["statements"], verts_keep, indices_new)
+    obj["statements"] = [(int(faces_before[face]), line) for face, line in statements]
 
-    print("Calculate new line numbers for materials")
-    new_materials = []
-    count_verts_final = len(verts_final)
-    for e, (i, mtl) in enumerate(mtls):
-        print(v_start_index + count_verts_final + len_vt + np.sum(faces_keep_mask[:i - f_start_index]) + e)
-        new_materials.append((v_start_index + count_verts_final + len_vt + np.sum(faces_keep_mask[:i - f_start_index]) + e, mtl))
+    # Shorten the runs of lines in the layout of the file by what was removed
+    if obj.get("layout"):
+        before = {"v": np.concatenate(([0], np.cumsum(verts_keep))),
+                  "f": faces_before,
+                  "s": np.concatenate(([0], np.cumsum(statements_keep, dtype=np.int64)))}
+        obj["layout"] = [(kind, int(before[kind][end]) if kind in before else end) for kind, end in obj["layout"]]
 
-    print("Update vertex indices")
-    faces_final = []
-    for vertex_indices, face_raw in zip(faces_new, faces_new_raw):
-        uvs = [int(f.split("/")[1]) for f in face_raw.split()[1:]]
-        new_indices = [np.sum(verts_keep[:v]) for v in vertex_indices]
-        face_final = " ".join(["f"] + ["/".join([str(x) for x in c]) for c in list(zip(new_indices, uvs))]) + "\n"
-        faces_final.append(face_final)
-    
-    print("Replace content")
-    lines[f_start_index:] = faces_final
-    lines[v_start_index:v_start_index + len_v] = verts_final
+    return obj
+
+def remove_vertices(path_obj, indices_keep):
+    print("Read from file")
+    obj = read_obj(path_obj)
 
-    print("Add materials")
-    for i, mtl in new_materials:
-        lines.insert(i, mtl)
+    obj = filter_vertices(obj, indices_keep)
 
     print("Write to file")
-    with open(path_obj, "w") as file_obj:
-        file_obj.writelines(lines)
+    write_obj(path_obj, obj)
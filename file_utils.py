@@ -0,0 +1,18 @@
+from contextlib import contextmanager
+import os
+
+@contextmanager
+def atomic_path(path, keep_extension=False):
+    # Temporary path next to a file, to write the file to. The file is only replaced once
+    # writing has finished, so that an interrupted run never leaves it half written.
+    # With keep_extension, the temporary file has the same extension, for writers that
+    # choose the file format by it (e.g. USD)
+    root, extension = os.path.splitext(path)
+    path_tmp = f"{root}.tmp{extension}" if keep_extension else f"{path}.tmp"
+    try:
+        yield path_tmp
+    except BaseException:
+        if os.path.exists(path_tmp):
+            os.remove(path_tmp)
+        raise
+    os.replace(path_tmp, path)
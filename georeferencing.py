@@ -0,0 +1,49 @@
+from functools import lru_cache
+
+import numpy as np
+from pyproj import CRS, Transformer
+
+# Coordinate reference systems used throughout the project
+WGS84 = "EPSG:4326"
+UTM33N = "EPSG:32633"
+ROADRUNNER = "+proj=tmerc +lat_0=63.41771242884644 +lon_0=10.40335350836009 +k=1 +x_0=0 +y_0=0 +datum=WGS84 +units=m +vunits=m +no_defs"
+
+# UTM33N coordinates (easting, northing, height) of the Omniverse scene origin
+UTM_OFFSET = np.array([270630.659, 7040355.576, 46.670])
+
+# One transformer per CRS pair and process, as creating them is expensive
+@lru_cache(maxsize=None)
+def get_transformer(crs_from, crs_to):
+    return Transformer.from_crs(CRS.from_user_input(crs_from), CRS.from_user_input(crs_to))
+
+def project(a, b, crs_from, crs_to):
+    # Transform arrays of coordinates between two CRSs, in the axis order of the CRSs
+    # (e.g. latitude/longitude for WGS84, easting/northing for UTM)
+    transformer = get_transformer(crs_from, crs_to)
+    return transformer.transform(np.asarray(a, dtype=np.float64), np.asarray(b, dtype=np.float64))
+
+def wgs84_to_utm(lat, lon):
+    # Project from WGS84 (latlon) to UTM33N, returns easting and northing
+    return project(lat, lon, WGS84, UTM33N)
+
+def to_scene(array):
+    # Convert UTM33N coordinates (..., [easting, northing, height]) to Omniverse
+    # coordinates (..., [x, y, z]). Omniverse is Y up, with Z pointing south.
+    utm = np.asarray(array, dtype=np.float64)
+    scene = np.empty_like(utm)
+    scene[...,0] = utm[...,0] - UTM_OFFSET[0]
+    scene[...,1] = utm[...,2] - UTM_OFFSET[2]
+    scene[...,2] = -(utm[...,1] - UTM_OFFSET[1])
+
+    return scene
+
+def from_scene(array):
+    # Convert Omniverse coordinates (..., [x, y, z]) back to UTM33N coordinates
+    # (..., [easting, northing, height])
+    scene = np.asarray(array, dtype=np.float64)
+    utm = np.empty_like(scene)
+    utm[...,0] = scene[...,0] + UTM_OFFSET[0]
+    utm[...,1] = UTM_OFFSET[1] - scene[...,2]
+    utm[...,2] = scene[...,1] + UTM_OFFSET[2]
+
+    return utm
@@ -0,0 +1,299 @@
+from itertools import groupby, repeat
+import re
+
+import numpy as np
+
+from file_utils import atomic_path
+
+# Every line that is not a vertex or a face, e.g. usemtl, g, o, s, l, p, vp, comments or
+# blank lines. They are kept in place between the faces when writing
+STATEMENT = re.compile(r"\n((?!(?:v|vt|vn|f) )[^\n]*)(?=\n)")
+
+# Line types parsed into arrays, in the order write_obj groups them if the layout of the file is lost
+ELEMENTS = ["v", "vt", "vn", "f"]
+
+# Keywords of OBJ lines. Other lines from a newmtl line until the first vertex or face are
+# taken as embedded material definitions
+KEYWORDS = {"v", "vt", "vn", "vp", "f", "l", "p", "usemtl", "mtllib", "g", "o", "s"}
+
+# Rows formatted at a time when writing
+CHUNK_SIZE = 1 << 16
+
+def count_spaces(lines):
+    # Number of spaces in every line, i.e. the number of values minus one
+    return np.fromiter(map(str.count, lines, repeat(" ")), dtype=np.int32, count=len(lines))
+
+def parse_floats(lines, columns):
+    # Parse the numbers of many lines at once, split into the first columns and any
+    # further ones (e.g. vertex colors), which are None if there are none
+    if not lines:
+        return np.zeros((0, columns), dtype=np.float64), None
+
+    # All lines must have the same number of values, or the rows would be shifted silently
+    widths = count_spaces(lines) + 1
+    width = int(widths[0])
+    if (widths != width).any():
+        raise ValueError("Lines of the same type with different numbers of values are not supported")
+    values = np.fromstring(" ".join(lines), dtype=np.float64, sep=" ")
+    if values.size != width * len(lines):
+        raise ValueError("Malformed numbers")
+    values = values.reshape(-1, width)
+    return values[:, :columns], values[:, columns:] if width > columns else None
+
+def parse_faces(lines):
+    # Parse face corners (v, v/vt, v//vn or v/vt/vn) into one-based index arrays, which
+    # may be negative (relative). All corners of a file must have the same layout
+    if not lines:
+        return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int64), None, None
+
+    counts = count_spaces(lines) + 1
+    first = lines[0].split(" ", 1)[0]
+    columns = first.count("/") + 1
+    text = " ".join(lines)
+
+    # Every corner has the slashes of the first one if none has more and the total matches
+    corners = int(counts.sum())
+    slashes = columns - 1
+    doubles = corners if "//" in first else 0
+    if (text.count("/") != corners * slashes or text.count("//") != doubles
+            or (slashes and re.search("/[^ /]*" * (slashes + 1), text))):
+        raise ValueError("Faces with different corner layouts (v, v/vt, v//vn, v/vt/vn) are not supported")
+
+    indices = np.fromstring(text.replace("//", "/0/").replace("/", " "), dtype=np.int64, sep=" ")
+    if indices.size != corners * columns:
+        raise ValueError("Malformed face indices")
+    indices = indices.reshape(-1, columns)
+
+    v = indices[:, 0]
+    vt = indices[:, 1] if columns > 1 and "//" not in first else None
+    vn = indices[:, 2] if columns > 2 else None
+    return counts, v, vt, vn
+
+def split_runs(chunk):
+    # Lines between two statements, grouped into runs of the same type in file order.
+    # Usually every type forms one run in the order of ELEMENTS, which is found in bulk
+    present = [keyword for keyword in ELEMENTS if f"\n{keyword} " in chunk]
+    if all(chunk.rfind(f"\n{a} ") < chunk.find(f"\n{b} ") for a, b in zip(present, present[1:])):
+        return [(keyword, re.findall(f"\n{keyword} ([^\n]*)", chunk)) for keyword in present]
+
+    # Types that take turns, e.g. vertices defined between faces
+    lines = (line.partition(" ") for line in chunk.split("\n") if line)
+    return [(keyword, [line[2] for line in group]) for keyword, group in groupby(lines, key=lambda line: line[0])]
+
+def resolve_indices(indices, bases):
+    # Make one-based indices zero-based. Negative indices count back from the number of
+    # elements defined before the face, which bases gives per corner
+    if indices is None:
+        return None
+    if (indices == 0).any():
+        raise ValueError("Face index 0 is not valid")
+
+    relative = indices < 0
+    if not relative.any():
+        return indices - 1
+    indices = np.where(relative, bases() + indices, indices - 1)
+    if (indices < 0).any():
+        raise ValueError("Relative face index before the first element")
+    return indices
+
+def read_obj(path_obj):
+    # Parse an OBJ file into NumPy arrays:
+    #   points, uvs, normals: one row per v, vt and vn line
+    #   point_extras, uv_extras: further values of v and vt lines, e.g. vertex colors (None if not in the file)
+    #   counts: number of corners per face, offsets: index of the first corner of each face (and the end)
+    #   v_indices, vt_indices, vn_indices: zero-based indices per face corner (None if not in the file)
+    #   materials: (name, first face, end face) per usemtl line
+    #   statements: (face, line) of all other lines, to write them back in place
+    #   comments: comment lines at the top of the file
+    #   layout: (type, end) per run of v, vt, vn, f or statement ("s") lines, in file order
+    with open(path_obj) as objfile:
+        text = objfile.read()
+
+    # Single spaces between tokens, none at the end of lines
+    if "\t" in text or "  " in text or " \n" in text:
+        text = re.sub(r" +$", "", re.sub(r"[ \t]+", " ", text), flags=re.M)
+    if text.endswith("\n"):
+        text = text[:-1]
+
+    # Split the file at the statements, and parse everything between them in bulk
+    chunks = STATEMENT.split(f"\n{text}\n")
+    elements = {keyword: [] for keyword in ELEMENTS}
+    statements = []
+    comments = []
+    mtllibs = []
+    mtl_lines = []
+    layout = []
+    face_runs = []
+    header = True
+
+    def add_run(kind, end):
+        # Consecutive lines of the same type form one run
+        if layout and layout[-1][0] == kind:
+            layout[-1] = (kind, end)
+        else:
+            layout.append((kind, end))
+
+    for i, chunk in enumerate(chunks):
+        if not i % 2:
+            for keyword, lines in split_runs(chunk):
+                # Elements defined before every run of faces, for relative indices
+                if keyword == "f":
+                    face_runs.append((len(lines), len(elements["v"]), len(elements["vt"]), len(elements["vn"])))
+                elements[keyword] += lines
+                add_run(keyword, len(elements[keyword]))
+            header = header and not chunk.strip()
+            continue
+
+        keyword = chunk.split(" ", 1)[0]
+        if keyword == "mtllib":
+            mtllibs.append(chunk[len("mtllib "):])
+        elif header and mtl_lines and not chunk:
+            # write_obj separates the embedded materials with blank lines itself
+            continue
+        elif header and keyword not in KEYWORDS and (mtl_lines or keyword == "newmtl"):
+            # Material definitions embedded in the file (see embed_materials)
+            mtl_lines.append(chunk)
+        elif header and keyword.startswith("#"):
+            comments.append(chunk)
+        else:
+            statements.append((len(elements["f"]), chunk))
+            add_run("s", len(statements))
+
+    v, vt, vn, f = [elements[keyword] for keyword in ELEMENTS]
+    counts, v_indices, vt_indices, vn_indices = parse_faces(f)
+
+    def bases(column):
+        # Number of elements defined before every face corner
+        sizes = np.array([run[0] for run in face_runs])
+        defined = np.array([run[column] for run in face_runs])
+        return lambda: np.repeat(np.repeat(defined, sizes), counts)
+
+    v_indices = resolve_indices(v_indices, bases(1))
+    vt_indices = resolve_indices(vt_indices, bases(2))
+    vn_indices = resolve_indices(vn_indices, bases(3))
+    points, point_extras = parse_floats(v, 3)
+    uvs, uv_extras = parse_floats(vt, 2)
+    normals, _ = parse_floats(vn, 3)
+
+    # Range of faces every material is used for
+    usemtl = [(face, line.split()[1]) for face, line in statements if line.startswith("usemtl ")]
+    ends = [face for face, _ in usemtl[1:]] + [len(counts)]
+    materials = [(name, start, end) for (start, name), end in zip(usemtl, ends)]
+
+    return {
+        "points": points,
+        "point_extras": point_extras,
+        "uvs": uvs,
+        "uv_extras": uv_extras,
+        "normals": normals,
+        "counts": counts,
+        "offsets": np.concatenate(([0], np.cumsum(counts, dtype=np.int64))),
+        "v_indices": v_indices,
+        "vt_indices": vt_indices,
+        "vn_indices": vn_indices,
+        "materials": materials,
+        "statements": statements,
+        "comments": comments,
+        "mtllibs": mtllibs,
+        "mtl_lines": mtl_lines,
+        "layout": layout
+    }
+
+def format_rows(prefix, values, precision=None):
+    # Format all rows of an array in one go. Without a precision, every number gets as
+    # many digits as it needs to be read back exactly
+    number = "%r" if precision is None else f"%.{precision}f"
+    row = prefix + " " + " ".join([number] * values.shape[1]) + "\n"
+    return (row * len(values)) % tuple(values.ravel().tolist())
+
+def format_faces(obj, start, end):
+    # Format the faces in a range, with one-based indices in the layout they were read with
+    begin, finish = obj["offsets"][start], obj["offsets"][end]
+    columns = [obj["v_indices"][begin:finish]]
+    if obj["vt_indices"] is not None:
+        columns.append(obj["vt_indices"][begin:finish])
+    if obj["vn_indices"] is not None:
+        columns.append(obj["vn_indices"][begin:finish])
+    values = np.column_stack(columns) + 1
+
+    if obj["vn_indices"] is not None and obj["vt_indices"] is None:
+        corner = "%d//%d"
+    else:
+        corner = "/".join(["%d"] * len(columns))
+
+    # Faces with the same number of corners share a template
+    counts = obj["counts"][start:end]
+    templates = {k: "f " + " ".join([corner] * k) + "\n" for k in np.unique(counts).tolist()}
+    if len(templates) == 1:
+        text = next(iter(templates.values())) * len(counts)
+    else:
+        text = "".join([templates[k] for k in counts.tolist()])
+    return text % tuple(values.ravel().tolist())
+
+def fits_layout(layout, lengths, statements):
+    # Whether the layout read from the file still matches the arrays and statements,
+    # i.e. every run ends within its array and every statement is still at its face
+    if not layout:
+        return False
+
+    ends = dict.fromkeys(lengths, 0)
+    for kind, end in layout:
+        if kind == "s" and any(face != ends["f"] for face, _ in statements[ends["s"]:end]):
+            return False
+        ends[kind] = end
+    return ends == lengths
+
+def group_layout(lengths, statements):
+    # Vertex data first, then the faces with the statements in between them
+    layout = [(kind, lengths[kind]) for kind in ["v", "vt", "vn"]]
+    for i, (face, _) in enumerate(statements):
+        layout += [("f", face), ("s", i + 1)]
+    return layout + [("f", lengths["f"])]
+
+def write_obj(path_obj, obj, precision=None):
+    # Write an OBJ file as read by read_obj, formatting whole blocks of lines at once.
+    # Lines are written in the layout of the file they were read from, as long as
+    # it still fits. The file is written next to the target first, and swapped in when complete
+
+    # usemtl lines are taken from the materials, so that they can be renamed or moved
+    statements = []
+    materials = iter(obj["materials"])
+    for face, line in obj["statements"]:
+        if line.startswith("usemtl "):
+            name, face, _ = next(materials)
+            line = f"usemtl {name}"
+        statements.append((face, line))
+
+    lengths = {"v": len(obj["points"]), "vt": len(obj["uvs"]), "vn": len(obj["normals"]),
+               "f": len(obj["counts"]), "s": len(statements)}
+    layout = obj.get("layout")
+    if not fits_layout(layout, lengths, statements):
+        statements.sort(key=lambda statement: statement[0])
+        layout = group_layout(lengths, statements)
+
+    with atomic_path(path_obj) as path_tmp, open(path_tmp, "w", buffering=1 << 20) as objfile:
+        for comment in obj["comments"]:
+            objfile.write(f"{comment}\n")
+        for mtllib in obj["mtllibs"]:
+            objfile.write(f"mtllib {mtllib}\n")
+        if obj["mtl_lines"]:
+            objfile.write("\n".join(obj["mtl_lines"]).replace("\nnewmtl ", "\n\nnewmtl ") + "\n\n")
+
+        rows = {"v": ("points", "point_extras"), "vt": ("uvs", "uv_extras"), "vn": ("normals", None)}
+        written = dict.fromkeys(lengths, 0)
+        for kind, end in layout:
+            start = written[kind]
+            if kind == "s":
+                for _, line in statements[start:end]:
+                    objfile.write(f"{line}\n")
+            elif kind == "f":
+                for i in range(start, end, CHUNK_SIZE):
+                    objfile.write(format_faces(obj, i, min(i + CHUNK_SIZE, end)))
+            else:
+                key, extras = rows[kind]
+                for i in range(start, end, CHUNK_SIZE):
+                    values = obj[key][i:min(i + CHUNK_SIZE, end)]
+                    if extras and obj[extras] is not None:
+                        values = np.hstack((values, obj[extras][i:min(i + CHUNK_SIZE, end)]))
+                    objfile.write(format_rows(kind, values, precision))
+            written[kind] = end
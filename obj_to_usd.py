@@ -0,0 +1,192 @@
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import os
+import re
+import shutil
+import sys
+
+import numpy as np
+from pxr import Sdf, Tf, Usd, UsdGeom, UsdShade, Vt
+
+from file_utils import atomic_path
+from obj_io import read_obj
+
+# Bump when the conversion changes, so that converted files are redone
+CONVERTER_VERSION = 1
+
+# Folder holding every converted file, named by the hash of its source
+CACHE_DIR = "usd_cache"
+
+def get_usd_path(path_obj):
+    # The crate file is written next to the OBJ file, so texture paths stay valid
+    return f"{os.path.splitext(path_obj)[0]}.usdc"
+
+def parse_mtl_lines(lines):
+    # Diffuse color, opacity and diffuse texture of every material
+    materials = {}
+    material = None
+    for line in lines:
+        tokens = line.split()
+        if not tokens:
+            continue
+        if tokens[0] == "newmtl":
+            material = materials[tokens[1]] = {"Kd": (0.8, 0.8, 0.8), "d": 1.0, "map_Kd": None}
+        elif material is None:
+            continue
+        elif tokens[0] == "Kd":
+            material["Kd"] = tuple(float(c) for c in tokens[1:4])
+        elif tokens[0] == "d":
+            material["d"] = float(tokens[1])
+        elif tokens[0] == "Tr":
+            material["d"] = 1.0 - float(tokens[1])
+        elif tokens[0] == "map_Kd":
+            # The file name is the last token, after any options
+            material["map_Kd"] = tokens[-1]
+    return materials
+
+def read_materials(path_obj, obj):
+    # Materials from the referenced .mtl files, and those embedded in the OBJ file itself
+    lines = list(obj["mtl_lines"])
+    for mtllib in obj["mtllibs"]:
+        path_mtl = os.path.join(os.path.dirname(path_obj), mtllib)
+        if os.path.exists(path_mtl):
+            with open(path_mtl) as mtlfile:
+                lines += mtlfile.read().splitlines()
+    return parse_mtl_lines(lines)
+
+def hash_source(path_obj):
+    # Hash of the OBJ file and its material files. Textures are referenced, not copied
+    with open(path_obj, "rb") as objfile:
+        content = objfile.read()
+    sha256 = hashlib.sha256(f"{CONVERTER_VERSION}".encode())
+    sha256.update(content)
+
+    for mtllib in re.findall(rb"^mtllib +(.+?)\s*$", content, re.M):
+        path_mtl = os.path.join(os.path.dirname(path_obj), mtllib.decode())
+        if os.path.exists(path_mtl):
+            with open(path_mtl, "rb") as mtlfile:
+                sha256.update(mtlfile.read())
+    return sha256.hexdigest()
+
+def is_converted(path_usd, source_hash):
+    if not os.path.exists(path_usd):
+        return False
+    layer = Sdf.Layer.FindOrOpen(path_usd)
+    return layer is not None and layer.customLayerData.get("sourceHash") == source_hash
+
+def create_material(stage, path, material):
+    # UsdPreviewSurface with the diffuse color, or the diffuse texture if there is one
+    usd_material = UsdShade.Material.Define(stage, path)
+    shader = UsdShade.Shader.Define(stage, f"{path}/PreviewSurface")
+    shader.CreateIdAttr("UsdPreviewSurface")
+    shader.CreateInput("roughness", Sdf.ValueTypeNames.Float).Set(0.9)
+    shader.CreateInput("opacity", Sdf.ValueTypeNames.Float).Set(material["d"])
+    usd_material.CreateSurfaceOutput().ConnectToSource(shader.ConnectableAPI(), "surface")
+
+    if material["map_Kd"]:
+        reader = UsdShade.Shader.Define(stage, f"{path}/TexCoordReader")
+        reader.CreateIdAttr("UsdPrimvarReader_float2")
+        reader.CreateInput("varname", Sdf.ValueTypeNames.Token).Set("st")
+
+        texture = UsdShade.Shader.Define(stage, f"{path}/DiffuseTexture")
+        texture.CreateIdAttr("UsdUVTexture")
+        texture.CreateInput("file", Sdf.ValueTypeNames.Asset).Set(material["map_Kd"].replace("\\", "/"))
+        texture.CreateInput("st", Sdf.ValueTypeNames.Float2).ConnectToSource(reader.ConnectableAPI(), "result")
+        texture.CreateOutput("rgb", Sdf.ValueTypeNames.Float3)
+        shader.CreateInput("diffuseColor", Sdf.ValueTypeNames.Color3f).ConnectToSource(texture.ConnectableAPI(), "rgb")
+    else:
+        shader.CreateInput("diffuseColor", Sdf.ValueTypeNames.Color3f).Set(material["Kd"])
+
+    return usd_material
+
+def create_usd(path_usd, obj, materials, source_hash):
+    # Write the mesh and its materials to a new USD file
+    stage = Usd.Stage.CreateNew(path_usd)
+    root = UsdGeom.Xform.Define(stage, "/Root")
+    stage.SetDefaultPrim(root.GetPrim())
+
+    mesh = UsdGeom.Mesh.Define(stage, "/Root/mesh")
+    mesh.CreateSubdivisionSchemeAttr(UsdGeom.Tokens.none)
+    points = obj["points"].astype(np.float32)
+    mesh.CreatePointsAttr(Vt.Vec3fArray.FromNumpy(points))
+    mesh.CreateFaceVertexCountsAttr(Vt.IntArray.FromNumpy(obj["counts"]))
+    mesh.CreateFaceVertexIndicesAttr(Vt.IntArray.FromNumpy(obj["v_indices"].astype(np.int32)))
+    if len(points):
+        mesh.CreateExtentAttr([points.min(axis=0).tolist(), points.max(axis=0).tolist()])
+
+    # Texture coordinates and normals are indexed per face corner, like in the OBJ file
+    primvars = UsdGeom.PrimvarsAPI(mesh)
+    if obj["vt_indices"] is not None and len(obj["uvs"]):
+        st = primvars.CreatePrimvar("st", Sdf.ValueTypeNames.TexCoord2fArray, UsdGeom.Tokens.faceVarying)
+        st.Set(Vt.Vec2fArray.FromNumpy(obj["uvs"].astype(np.float32)))
+        st.SetIndices(Vt.IntArray.FromNumpy(obj["vt_indices"].astype(np.int32)))
+    if obj["vn_indices"] is not None and len(obj["normals"]):
+        normals = primvars.CreatePrimvar("normals", Sdf.ValueTypeNames.Normal3fArray, UsdGeom.Tokens.faceVarying)
+        normals.Set(Vt.Vec3fArray.FromNumpy(obj["normals"].astype(np.float32)))
+        normals.SetIndices(Vt.IntArray.FromNumpy(obj["vn_indices"].astype(np.int32)))
+
+    # One subset per material, with all the faces it is used on
+    faces = {}
+    for name, start, end in obj["materials"]:
+        if end > start:
+            faces.setdefault(name, []).append(np.arange(start, end, dtype=np.int32))
+
+    binding = UsdShade.MaterialBindingAPI.Apply(mesh.GetPrim())
+    for name, ranges in faces.items():
+        identifier = Tf.MakeValidIdentifier(name)
+        usd_material = create_material(stage, f"/Root/Looks/{identifier}", materials.get(name, {"Kd": (0.8, 0.8, 0.8), "d": 1.0, "map_Kd": None}))
+        if len(faces) == 1 and len(ranges[0]) == len(obj["counts"]):
+            binding.Bind(usd_material)
+            break
+        subset = binding.CreateMaterialBindSubset(identifier, Vt.IntArray.FromNumpy(np.concatenate(ranges)), UsdGeom.Tokens.face)
+        UsdShade.MaterialBindingAPI.Apply(subset.GetPrim()).Bind(usd_material)
+
+    stage.GetRootLayer().customLayerData = {"sourceHash": source_hash}
+    stage.GetRootLayer().Save()
+
+def write_usd(path_usd, obj, materials, source_hash):
+    # Write to a new crate file, and swap it in when complete
+    with atomic_path(path_usd, keep_extension=True) as path_tmp:
+        create_usd(path_tmp, obj, materials, source_hash)
+
+def convert_obj(path_obj, force=False, cache_dir=CACHE_DIR):
+    # Convert an OBJ file with its materials to a binary USD file, unless it is up to date.
+    # Converted files are also kept in a cache by source hash, so that the same building
+    # extracted again (e.g. from the export cache) is not converted again
+    path_usd = get_usd_path(path_obj)
+    source_hash = hash_source(path_obj)
+    if not force and is_converted(path_usd, source_hash):
+        return path_usd, False
+
+    path_cached = os.path.join(cache_dir, f"{source_hash}.usdc")
+    if not force and os.path.exists(path_cached):
+        shutil.copyfile(path_cached, path_usd)
+        return path_usd, False
+
+    obj = read_obj(path_obj)
+    write_usd(path_usd, obj, read_materials(path_obj, obj), source_hash)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    with atomic_path(path_cached) as path_tmp:
+        shutil.copyfile(path_usd, path_tmp)
+    return path_usd, True
+
+def convert_objs(path="buildings/wavefrontobj", workers=None, force=False, cache_dir=CACHE_DIR):
+    # Convert all OBJ files in a folder, spread over all cores
+    obj_paths = [os.path.join(root, f) for root, _, files in os.walk(path)
+                 for f in files if f.endswith(".obj")]
+
+    print(f"Converting {len(obj_paths)} OBJ files to USD...")
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(convert_obj, obj_paths, [force] * len(obj_paths), [cache_dir] * len(obj_paths)))
+
+    converted = sum(converted for _, converted in results)
+    print(f"Converted {converted} files, {len(obj_paths) - converted} already up to date")
+    return [path_usd for path_usd, _ in results]
+
+if __name__ == "__main__":
+    for path in sys.argv[1:]:
+        if os.path.isdir(path):
+            convert_objs(path)
+        else:
+            print(convert_obj(path, force=True)[0])
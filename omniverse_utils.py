@@ -1,8 +1,9 @@
 import omni.client
 from pxr import Usd, UsdGeom, Gf
 
-def open_stage(stage_url):
-    return Usd.Stage.Open(stage_url)
+def open_stage(stage_url, load_payloads=True):
+    # Without loading payloads, the stage opens without reading the assets they point to
+    return Usd.Stage.Open(stage_url, Usd.Stage.LoadAll if load_payloads else Usd.Stage.LoadNone)
 
 def start_omniverse(do_live_edit):
     omni.client.usd_live_set_default_enabled(do_live_edit)
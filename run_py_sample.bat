@@ -23,6 +23,8 @@ if not exist "%PYTHON%" (
 ::start "car2" "%PYTHON%" source\pyHelloWorld\connector_gnss.py "gnss52_trip4.csv" "car2" %*
 ::start "car3" "%PYTHON%" source\pyHelloWorld\connector_gnss.py "gnss50.csv" "car3" %*
 ::start "car4" "%PYTHON%" source\pyHelloWorld\connector_gnss.py "gnss52.csv" "car4" %*
+::Alternatively, drive all cars from one connector on a shared clock
+::"%PYTHON%" source\pyHelloWorld\connector_fleet.py "gnss52_trip3.csv" "car" "gnss52_trip4.csv" "car2" "gnss50.csv" "car3" "gnss52.csv" "car4"
 ::"%PYTHON%" source\pyHelloWorld\connector_gnss.py "gnss52_trip3.csv" "car"
 "%PYTHON%" chapter_10_wall_projective/auto_perspective_correction.py
 
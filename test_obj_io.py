@@ -0,0 +1,122 @@
+import numpy as np
+import pytest
+
+from obj_io import read_obj, write_obj
+
+# Vertex colors, free-form lines, points, lines, comments, blank lines and unknown statements,
+# with numbers as write_obj formats them
+OBJ = """# Exported for a round-trip test
+mtllib walls.mtl
+
+o wall
+v 0.0 0.0 0.0 1.0 0.0 0.0
+v 1.0 0.0 0.0 0.0 1.0 0.0
+v 1.0 1.0 0.0 0.0 0.0 1.0
+v 0.0 1.0 0.0 0.5 0.5 0.5
+vt 0.0 0.0
+vt 1.0 0.0
+vt 1.0 1.0
+vp 0.25 0.5
+vp 0.75 0.5
+
+# Faces
+usemtl brick
+g front
+s 1
+f 1/1 2/2 3/3
+shading_rate 2
+usemtl glass
+f 1/1 3/3 4/2
+l 1 2 3
+p 4
+curv 0.0 1.0 1 2
+"""
+
+# One object after the other, each with its vertices right before its faces
+INTERLEAVED = """o first
+v 0.0 0.0 0.0
+v 1.0 0.0 0.0
+v 1.0 1.0 0.0
+f 1 2 3
+
+o second
+v 2.0 0.0 0.0
+v 3.0 0.0 0.0
+v 3.0 1.0 0.0
+f 4 5 6
+"""
+
+def write_read(tmp_path, text):
+    path_obj = str(tmp_path / "wall.obj")
+    with open(path_obj, "w") as objfile:
+        objfile.write(text)
+    return path_obj, read_obj(path_obj)
+
+def read_text(path_obj):
+    with open(path_obj) as objfile:
+        return objfile.read()
+
+def test_round_trip(tmp_path):
+    path_obj, obj = write_read(tmp_path, OBJ)
+
+    # Extra vertex columns are kept apart from the points
+    assert obj["points"].shape == (4, 3)
+    assert obj["point_extras"].shape == (4, 3)
+    assert obj["materials"] == [("brick", 0, 1), ("glass", 1, 2)]
+
+    # Every line is written back in place
+    write_obj(path_obj, obj)
+    assert read_text(path_obj) == OBJ
+
+    # Reading the written file again gives the same arrays
+    again = read_obj(path_obj)
+    for key in ["points", "point_extras", "uvs", "v_indices", "vt_indices", "counts"]:
+        np.testing.assert_array_equal(again[key], obj[key])
+    assert again["statements"] == obj["statements"]
+
+def test_precision(tmp_path):
+    # UTM coordinates and tiny offsets survive a round trip exactly
+    path_obj, obj = write_read(tmp_path, "v 569123.123456789 7034567.987654321 12.3\nv 1e-09 -2.5e-12 0.1\nf 1 2 1\n")
+    points = obj["points"].copy()
+    write_obj(path_obj, obj)
+    np.testing.assert_array_equal(read_obj(path_obj)["points"], points)
+
+    # A fixed number of decimals can still be asked for
+    write_obj(path_obj, obj, precision=2)
+    assert read_text(path_obj).startswith("v 569123.12 7034567.99 12.30\n")
+
+def test_interleaved(tmp_path):
+    # Vertices between faces stay where they were
+    path_obj, obj = write_read(tmp_path, INTERLEAVED)
+    write_obj(path_obj, obj)
+    assert read_text(path_obj) == INTERLEAVED
+
+    # Without a layout that fits, vertices go first and statements stay at their faces
+    obj["points"] = obj["points"][:5]
+    write_obj(path_obj, obj)
+    assert read_text(path_obj).split("\n")[5:] == ["o first", "f 1 2 3", "", "o second", "f 4 5 6", ""]
+
+def test_relative_indices(tmp_path):
+    # Negative indices count back from the vertices defined before the face
+    text = INTERLEAVED.replace("f 1 2 3", "f -3 -2 -1").replace("f 4 5 6", "f -3 5 -1")
+    path_obj, obj = write_read(tmp_path, text)
+    np.testing.assert_array_equal(obj["v_indices"], [0, 1, 2, 3, 4, 5])
+
+    # They are written back as absolute indices
+    write_obj(path_obj, obj)
+    assert read_text(path_obj) == INTERLEAVED
+
+    with pytest.raises(ValueError):
+        write_read(tmp_path, "v 0 0 0\nf -2 -1 1\n")
+    with pytest.raises(ValueError):
+        write_read(tmp_path, "v 0 0 0\nf 0 1 1\n")
+
+@pytest.mark.parametrize("text", [
+    "v 0 0 0\nvt 0 0\nf 1/1 1/1 1/1\nf 1 1 1\n",
+    "v 0 0 0\nvt 0 0\nvn 0 0 1\nf 1/1/1 1/1/1 1/1/1\nf 1//1 1//1 1//1\n",
+    "v 0 0 0\nv 0 0 0 1 1 1\nf 1 2 1\n",
+])
+def test_mixed_layouts(tmp_path, text):
+    # Face corners and vertices must have the same number of values throughout a file
+    with pytest.raises(ValueError):
+        write_read(tmp_path, text)